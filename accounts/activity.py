@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+
+from .buffers import WriteBehindBuffer
+from .cache import user_cache
+from .models import User
+
+
+class LastLoginBuffer(WriteBehindBuffer):
+    """
+    Coalesces ``User.last_login`` updates per user and writes each batch as a
+    single ``UPDATE ... SET last_login = CASE id WHEN ... END``.
+    """
+
+    name = "last-login"
+
+    def merge(self, old, new):
+        return max(old, new)
+
+    def write(self, items):
+        User.objects.filter(pk__in=items.keys()).update(
+            last_login=Case(
+                *(When(pk=pk, then=Value(timestamp)) for pk, timestamp in items.items()),
+                output_field=DateTimeField(),
+            )
+        )
+        # update() sends no signals, so drop the cached copies here
+        for pk in items:
+            user_cache.delete(pk)
+
+    def record(self, user, timestamp):
+        user.last_login = timestamp
+        self.add(user.pk, timestamp)
+
+
+last_login_buffer = LastLoginBuffer(
+    batch_size=settings.LAST_LOGIN_BUFFER["BATCH_SIZE"],
+    flush_interval=settings.LAST_LOGIN_BUFFER["FLUSH_INTERVAL"],
+)
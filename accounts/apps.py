@@ -4,3 +4,32 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from rest_framework_simplejwt.tokens import Token
+
+        from core import metrics
+        from core.db.pool import pool_stats
+        from core.log import log_stats
+
+        from . import schema, signals  # noqa: F401
+        from .cache import user_cache
+        from .hashing import hashing
+        from .keys import get_token_backend
+        from .notifications import dispatcher
+        from .revocation import revocation_index
+        from .throttling import TokenBucketThrottle
+
+        token_backend = get_token_backend()
+        if token_backend is not None:
+            Token._token_backend = token_backend
+
+        connection_created.connect(metrics.install_query_timer, dispatch_uid="core_metrics_query_timer")
+        metrics.registry.register_collector("user_cache", user_cache.stats)
+        metrics.registry.register_collector("revocation_index", revocation_index.stats)
+        metrics.registry.register_collector("hashing", hashing.stats, label="operation")
+        metrics.registry.register_collector("db_pool", pool_stats, label="pool")
+        metrics.registry.register_collector("notifications", dispatcher.stats)
+        metrics.registry.register_collector("throttle", TokenBucketThrottle.stats, label="scope")
+        metrics.registry.register_collector("log", log_stats)
@@ -0,0 +1,172 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+from django.views import View
+from rest_framework import exceptions, permissions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt import views as jwt_views
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from . import views
+from .activity import last_login_buffer
+from .authentication import CachedJWTAuthentication
+from .backends import EmailBackend
+from .serializers import LoginSerializer, TokenRefreshSerializer, TokenVerifySerializer, UserUpdateSerializer
+from .views import aget_user_response
+
+BEARER_CHALLENGE = 'Bearer realm="api"'
+
+
+class AsyncAPIView(View):
+    """
+    The subset of APIView the hot endpoints need, as a native async Django
+    view: request parsing, JWT authentication, ``permission_classes``,
+    ``throttle_classes`` and DRF's exception handling and JSON rendering,
+    without a thread hop per request. Permissions are checked inline, so they
+    must not query the database; throttles without ``aallow_request()`` run
+    in a thread. ``schema_view`` is the DRF view serving the same route under
+    WSGI; its schema is reused for this one.
+    """
+
+    schema_view = None
+    authenticate = False
+    authenticate_header = None
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    throttle_scope = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        if cls.schema_view is not None:
+            for attr in ("cls", "initkwargs", "actions"):
+                if hasattr(cls.schema_view, attr):
+                    setattr(view, attr, getattr(cls.schema_view, attr))
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            await self.initial(request)
+            handler = getattr(self, request.method.lower(), None)
+            if handler is None:
+                raise exceptions.MethodNotAllowed(request.method)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        return self.finalize_response(response)
+
+    async def initial(self, request):
+        request.user = AnonymousUser()
+        request.auth = None
+        if self.authenticate:
+            result = await CachedJWTAuthentication().aauthenticate(request)
+            if result is not None:
+                request.user, request.auth = result
+        self.check_permissions(request)
+        await self.check_throttles(request)
+        self.data = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]).data
+
+    def check_permissions(self, request):
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if self.authenticate and request.auth is None:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, "message", None),
+                                                  getattr(permission, "code", None))
+
+    async def check_throttles(self, request):
+        durations = []
+        for throttle in [throttle() for throttle in self.throttle_classes]:
+            if hasattr(throttle, "aallow_request"):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = await sync_to_async(throttle.allow_request)(request, self)
+            if not allowed:
+                durations.append(throttle.wait())
+        if durations:
+            raise exceptions.Throttled(max((d for d in durations if d is not None), default=None))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, TokenError):
+            exc = InvalidToken(exc.args[0])
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            if self.authenticate_header:
+                exc.auth_header = self.authenticate_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        response = api_settings.EXCEPTION_HANDLER(exc, {"view": self, "args": self.args, "kwargs": self.kwargs})
+        if response is None:
+            raise exc
+        return response
+
+    def finalize_response(self, response):
+        response.accepted_renderer = JSONRenderer()
+        response.accepted_media_type = JSONRenderer.media_type
+        response.renderer_context = {"view": self}
+        return response.render()
+
+
+class LoginView(AsyncAPIView):
+    schema_view = views.LoginView.as_view()
+    throttle_scope = "login"
+
+    async def post(self, request, *args, **kwargs):
+        serializer = LoginSerializer(data=self.data)
+        await serializer.ais_valid(raise_exception=True)
+        # LoginSerializer posts an email, which only EmailBackend accepts
+        user = await EmailBackend().aauthenticate(request, **serializer.validated_data)
+        if not user:
+            raise exceptions.AuthenticationFailed()
+        last_login_buffer.record(user, timezone.now())
+        data = await aget_user_response(user, request, "login")
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class TokenRefreshView(AsyncAPIView):
+    schema_view = views.TokenRefreshView.as_view()
+    authenticate_header = BEARER_CHALLENGE
+    throttle_scope = "refresh"
+
+    async def post(self, request, *args, **kwargs):
+        serializer = TokenRefreshSerializer(data=self.data)
+        await serializer.ais_valid(raise_exception=True)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+
+class TokenVerifyView(AsyncAPIView):
+    schema_view = jwt_views.TokenVerifyView.as_view()
+    authenticate_header = BEARER_CHALLENGE
+
+    async def post(self, request, *args, **kwargs):
+        serializer = TokenVerifySerializer(data=self.data)
+        await serializer.ais_valid(raise_exception=True)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+
+class ProfileView(AsyncAPIView):
+    schema_view = views.UserViewSet.as_view({"get": "retrieve", "patch": "partial_update", "delete": "destroy"})
+    authenticate = True
+    authenticate_header = BEARER_CHALLENGE
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request, *args, **kwargs):
+        data = await aget_user_response(request.user, request, "profile")
+        return Response(data)
+
+    async def patch(self, request, *args, **kwargs):
+        user = request.user
+        serializer = UserUpdateSerializer(user, data=self.data, partial=True)
+        await serializer.ais_valid(raise_exception=True)
+        for attr, value in serializer.validated_data.items():
+            setattr(user, attr, value)
+        await user.asave(update_fields=list(serializer.validated_data))
+        data = await aget_user_response(user, request, "profile_update")
+        return Response(data)
+
+    async def delete(self, request, *args, **kwargs):
+        await request.user.adelete()
+        return Response(status=status.HTTP_204_NO_CONTENT, data={"success": "User deleted"})
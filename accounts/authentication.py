@@ -0,0 +1,90 @@
+import copy
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from core.metrics import timer
+
+from .cache import user_cache
+from .routers import use_primary_if_pinned
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves ``request.user`` from the per-process
+    user cache, so authenticated requests on a warm cache run no user query.
+    Entries are dropped by the ``User`` post_save/post_delete signals.
+    """
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = self.get_cached_user(user_id)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            self.cache_user(user_id, user)
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = self.get_cached_user(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            self.cache_user(user_id, user)
+        return self.check_user(user, validated_token)
+
+    def get_cached_user(self, user_id):
+        """
+        A copy of the cached user, or None if it is not cached. A user pinned
+        to the primary was just written, possibly by another worker whose
+        eviction this cache never saw, so it is always read from there.
+        """
+        if use_primary_if_pinned(f"user:{user_id}"):
+            return None
+        user = user_cache.get(user_id)
+        if user is None:
+            return None
+        # every request gets its own instance, views are free to mutate it
+        return copy.copy(user)
+
+    def cache_user(self, user_id, user):
+        if user.is_active:
+            user_cache.set(user_id, copy.copy(user))
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    def get_validated_token(self, raw_token):
+        with timer("jwt_verify"):
+            return super().get_validated_token(raw_token)
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_user(self, user, validated_token):
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,41 @@
+from django.contrib.auth.backends import ModelBackend
+
+from . import hashing
+from .models import User
+from .routers import use_primary_if_pinned
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticates against ``User.email``, which is what LoginSerializer asks
+    for. Username logins (e.g. the admin) fall through to ModelBackend.
+    """
+
+    def get_lookup(self, email) -> dict:
+        email = User.objects.normalize_email(email)
+        use_primary_if_pinned(f"email:{email}")
+        return {"email": email}
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        try:
+            user = User.objects.get(**self.get_lookup(email))
+        except User.DoesNotExist:
+            # run the hasher anyway so response time doesn't reveal whether the email exists
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+
+    async def aauthenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        try:
+            user = await User.objects.aget(**self.get_lookup(email))
+        except User.DoesNotExist:
+            # same timing guard as authenticate()
+            await hashing.amake_password(password)
+            return None
+        if await user.acheck_password(password) and self.user_can_authenticate(user):
+            return user
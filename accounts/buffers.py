@@ -0,0 +1,100 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Keyed in-memory buffer whose contents a background thread hands to
+    ``write()`` in one batch every ``flush_interval`` seconds, or as soon as
+    ``batch_size`` keys are pending; ``add()`` never writes, so it is safe on
+    the event loop too. Adding an existing key replaces it via ``merge()``,
+    so repeated writes to one row cost a single write. A batch whose write
+    fails is merged back and retried, unless that would keep more than
+    ``max_batches`` batches pending.
+    """
+
+    name = "write-behind"
+    max_batches = 10
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        atexit.register(self.flush)
+
+    def __contains__(self, key) -> bool:
+        return key in self._pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def merge(self, old, new):
+        return new
+
+    def write(self, items: dict):
+        raise NotImplementedError
+
+    def add(self, key, value):
+        with self._lock:
+            if key in self._pending:
+                value = self.merge(self._pending[key], value)
+            self._pending[key] = value
+            full = len(self._pending) >= self.batch_size
+        self._ensure_flusher()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            items, self._pending = self._pending, {}
+        if not items:
+            return
+        try:
+            self.write(items)
+        except Exception:
+            self._restore(items)
+            raise
+
+    def _restore(self, items):
+        with self._lock:
+            if len(self._pending) + len(items) > self.batch_size * self.max_batches:
+                self.dropped += len(items)
+                logger.error("Dropping %d %s items after a failed write", len(items), self.name)
+                return
+            for key, value in items.items():
+                if key in self._pending:
+                    value = self.merge(value, self._pending[key])
+                self._pending[key] = value
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name=f"{self.name}-flusher", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        # without a flush_interval only full batches (and flush()) write
+        timeout = self.flush_interval if self.flush_interval > 0 else None
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush %s buffer", self.name)
+                # back off rather than retry on every full batch
+                time.sleep(max(self.flush_interval, 1))
+            finally:
+                connection.close()
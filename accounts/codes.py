@@ -0,0 +1,85 @@
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .notifications import notify
+
+CODE_LENGTH = 4
+
+
+class CodeLocked(Exception):
+    pass
+
+
+class VerificationCodes:
+    """
+    Short-lived confirmation codes kept in the cache tier.
+
+    Only an HMAC of the code (bound to the user, purpose and target value) is
+    stored, with the TTL set on the cache key, so expired codes disappear
+    without any sweeping. Issuing is a single cache write. Wrong guesses are
+    counted with an atomic ``cache.incr`` per user and purpose; the counter is
+    not touched by re-issuing, so asking for a new code does not buy more
+    guesses. After ``max_attempts`` failures within ``lockout`` seconds the
+    code is dropped and checks fail with CodeLocked until the counter expires.
+
+    The cache must be shared between workers (``CACHE_URL``); with the
+    default per-process locmem cache each worker keeps its own codes and
+    counters.
+    """
+
+    prefix = "vcode"
+
+    def __init__(self, ttl: int, max_attempts: int, lockout: int):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.lockout = lockout
+
+    def _key(self, user_id, purpose):
+        return f"{self.prefix}:{purpose}:{user_id}"
+
+    def _digest(self, user_id, purpose, target, code):
+        return salted_hmac(self.prefix, f"{purpose}:{user_id}:{target}:{code}").hexdigest()
+
+    def issue(self, user_id, purpose: str, target: str) -> str:
+        code = str(secrets.randbelow(10 ** CODE_LENGTH)).zfill(CODE_LENGTH)
+        cache.set(self._key(user_id, purpose), self._digest(user_id, purpose, target, code), self.ttl)
+        return code
+
+    def check(self, user_id, purpose: str, target: str, code: str) -> bool:
+        key = self._key(user_id, purpose)
+        attempts_key = f"{key}:attempts"
+        values = cache.get_many([key, attempts_key])
+        if values.get(attempts_key, 0) >= self.max_attempts:
+            raise CodeLocked()
+        stored = values.get(key)
+        if stored is None:
+            return False
+        if constant_time_compare(stored, self._digest(user_id, purpose, target, code)):
+            cache.delete_many([key, attempts_key])
+            return True
+        # the counter's window starts at the first failure and is not reset
+        # by issuing a new code
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            cache.add(attempts_key, 0, self.lockout)
+            attempts = cache.incr(attempts_key)
+        if attempts >= self.max_attempts:
+            cache.delete(key)
+            cache.touch(attempts_key, self.lockout)
+            raise CodeLocked()
+        return False
+
+
+verification_codes = VerificationCodes(
+    ttl=settings.VERIFICATION_CODES["TTL"],
+    max_attempts=settings.VERIFICATION_CODES["MAX_ATTEMPTS"],
+    lockout=settings.VERIFICATION_CODES["LOCKOUT"],
+)
+
+
+def send_code(channel: str, address: str, code: str):
+    notify(channel, address, "Confirmation code", f"Your confirmation code: {code}")
@@ -0,0 +1,97 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from phonenumber_field.phonenumber import PhoneNumber
+
+from .models import User
+from .serializers import UserResponseSerializer
+
+EXPORT_FIELDS = ("id",) + UserResponseSerializer.Meta.fields
+CHUNK_SIZE = 2000
+# rows are grouped into pieces of roughly this size before being yielded
+BUFFER_SIZE = 64 * 1024
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_queryset():
+    return User.objects.order_by("pk").values_list(*EXPORT_FIELDS)
+
+
+def _rows(queryset, chunk_size):
+    # iterator() streams through a server-side cursor on PostgreSQL
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield [str(value) if isinstance(value, PhoneNumber) else value for value in row]
+
+
+def iter_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in _rows(queryset, chunk_size):
+        yield (encoder.encode(dict(zip(EXPORT_FIELDS, row))) + "\n").encode()
+
+
+def iter_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS).encode()
+    for row in _rows(queryset, chunk_size):
+        yield writer.writerow(
+            [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+        ).encode()
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+    "csv": (iter_csv, "text/csv"),
+}
+
+
+def export_users(fmt="ndjson", gzip=False, chunk_size=CHUNK_SIZE):
+    """
+    Yields the whole user table as NDJSON or CSV bytes, optionally gzipped.
+    Only one ``chunk_size`` batch of rows is held in memory at a time.
+    """
+    rows, _ = FORMATS[fmt]
+    stream = buffered(rows(export_queryset(), chunk_size))
+    return gzipped(stream) if gzip else stream
+
+
+async def aexport_users(fmt="ndjson", gzip=False, chunk_size=CHUNK_SIZE):
+    """
+    ``export_users`` as an async iterator, for ASGI: Django buffers a sync
+    iterator of a StreamingHttpResponse whole there. The rows are still read
+    by the sync ORM, one piece at a time, in the thread sync_to_async uses
+    for it.
+    """
+    chunks = export_users(fmt, gzip=gzip, chunk_size=chunk_size)
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await step(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
@@ -0,0 +1,182 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import exceptions, status
+
+from core import metrics
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many concurrent password operations, try again later."
+    default_code = "hashing_busy"
+    # DRF's exception handler turns this into a Retry-After header
+    wait = 1
+
+
+def _check_password(password, encoded):
+    if not hashers.check_password(password, encoded):
+        return False, False
+    return True, hashers.identify_hasher(encoded).must_update(encoded)
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+class HashingExecutor:
+    """
+    Runs password hashing and verification in a bounded process pool so a
+    burst of logins cannot occupy every request thread. At most
+    ``max_pending`` operations are queued or running at once, including
+    ones whose caller timed out; the rest fail fast with HashingBusy. With ``workers=0`` operations run inline, still admitted and
+    measured.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                # only called for a broken pool, whose queued jobs have
+                # already failed, so there is nothing left to cancel
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _admit(self, operation):
+        if not self._slots.acquire(blocking=False):
+            self._record(operation, None)
+            raise HashingBusy()
+
+    def _record(self, operation, seconds):
+        with self._lock:
+            metric = self._metrics.setdefault(
+                operation, {"count": 0, "rejected": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+            )
+            if seconds is None:
+                metric["rejected"] += 1
+                return
+            metrics.record("password_hash", seconds)
+            metric["count"] += 1
+            metric["total_seconds"] += seconds
+            metric["max_seconds"] = max(metric["max_seconds"], seconds)
+
+    def _submit(self, func, *args):
+        """
+        Submits ``func`` to the pool. Its slot is released when the job
+        leaves the pool, not when the caller stops waiting for it.
+        """
+        try:
+            try:
+                future = self.executor.submit(func, *args)
+            except BrokenProcessPool:
+                self.shutdown()
+                future = self.executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        self._slots.release()
+
+    def run(self, operation, func, *args):
+        self._admit(operation)
+        started = time.perf_counter()
+        try:
+            if not self.workers:
+                try:
+                    return func(*args)
+                finally:
+                    self._slots.release()
+            future = self._submit(func, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except futures.TimeoutError:
+                # drops the job if still queued; a running one keeps its slot
+                future.cancel()
+                raise HashingBusy()
+        finally:
+            self._record(operation, time.perf_counter() - started)
+
+    async def arun(self, operation, func, *args):
+        self._admit(operation)
+        started = time.perf_counter()
+        try:
+            if not self.workers:
+                try:
+                    return func(*args)
+                finally:
+                    self._slots.release()
+            future = self._submit(func, *args)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                future.cancel()
+                raise HashingBusy()
+        finally:
+            self._record(operation, time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {operation: dict(metric) for operation, metric in self._metrics.items()}
+
+
+hashing = HashingExecutor(
+    workers=settings.PASSWORD_HASHING["WORKERS"],
+    max_pending=settings.PASSWORD_HASHING["MAX_PENDING"],
+    timeout=settings.PASSWORD_HASHING["TIMEOUT"],
+)
+
+
+def check_password(password, encoded):
+    """
+    Returns ``(valid, must_update)``; ``must_update`` is true when the stored
+    hash uses outdated parameters and should be re-made.
+    """
+    if password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    return hashing.run("check_password", _check_password, password, encoded)
+
+
+def make_password(password):
+    if password is None:
+        return hashers.make_password(None)
+    return hashing.run("make_password", _make_password, password)
+
+
+async def acheck_password(password, encoded):
+    if password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    return await hashing.arun("check_password", _check_password, password, encoded)
+
+
+async def amake_password(password):
+    if password is None:
+        return hashers.make_password(None)
+    return await hashing.arun("make_password", _make_password, password)
@@ -0,0 +1,85 @@
+import copy
+
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from .cache import user_cache
+from .revocation import revocation_index
+from .tokens import FAMILY_CLAIM, GENERATION_CLAIM, RefreshToken, current_families
+
+
+def get_users(user_ids) -> dict:
+    """
+    Users by id, from the user cache where possible and one ``IN`` query for
+    the rest.
+    """
+    users = {}
+    missing = []
+    for user_id in set(user_ids):
+        user = user_cache.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = user
+    if missing:
+        lookup = f"{api_settings.USER_ID_FIELD}__in"
+        for user in get_user_model().objects.filter(**{lookup: missing}):
+            user_id = getattr(user, api_settings.USER_ID_FIELD)
+            users[user_id] = user
+            if user.is_active:
+                user_cache.set(user_id, copy.copy(user))
+    return users
+
+
+def _is_family_refresh(token) -> bool:
+    return FAMILY_CLAIM in token and token.get(api_settings.TOKEN_TYPE_CLAIM) == RefreshToken.token_type
+
+
+def introspect(raw_tokens) -> list:
+    """
+    Checks a batch of tokens the way TokenVerifyView and
+    CachedJWTAuthentication check one. Signatures and expiry are verified
+    per token in memory; the blacklist, token families and users are each
+    looked up once for the whole batch. Results keep the input order.
+    """
+    results = []
+    tokens = []
+    for raw in raw_tokens:
+        try:
+            token = UntypedToken(raw)
+        except TokenError as e:
+            results.append({"active": False, "error": str(e.args[0])})
+            tokens.append(None)
+            continue
+        results.append(None)
+        tokens.append(token)
+
+    valid = [token for token in tokens if token is not None]
+    revoked_jtis = revocation_index.revoked(
+        token[api_settings.JTI_CLAIM] for token in valid if not _is_family_refresh(token)
+    )
+    families = current_families(
+        (token[FAMILY_CLAIM], token.get(GENERATION_CLAIM)) for token in valid if _is_family_refresh(token)
+    )
+    users = get_users(token[api_settings.USER_ID_CLAIM] for token in valid if api_settings.USER_ID_CLAIM in token)
+
+    for index, token in enumerate(tokens):
+        if token is None:
+            continue
+        if _is_family_refresh(token):
+            revoked = (token[FAMILY_CLAIM], token.get(GENERATION_CLAIM)) not in families
+        else:
+            revoked = token[api_settings.JTI_CLAIM] in revoked_jtis
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        user = users.get(user_id)
+        results[index] = {
+            "active": not revoked and user is not None and user.is_active,
+            "token_type": token.get(api_settings.TOKEN_TYPE_CLAIM),
+            "user_id": user_id,
+            "exp": token.get("exp"),
+            "revoked": revoked,
+            "user_active": user is not None and user.is_active,
+        }
+    return results
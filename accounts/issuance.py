@@ -0,0 +1,31 @@
+from django.conf import settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from .buffers import WriteBehindBuffer
+
+
+def should_issue_tokens(action: str) -> bool:
+    return action in settings.TOKEN_ISSUANCE["ACTIONS"]
+
+
+class OutstandingTokenBuffer(WriteBehindBuffer):
+    """
+    Collects OutstandingToken rows for freshly issued refresh tokens, keyed by
+    jti, and writes each batch with one bulk_create.
+    """
+
+    name = "outstanding-token"
+
+    def write(self, items):
+        # blacklist() on another worker may already have created the row for
+        # a pending jti, without a user; the buffered row supplies it
+        OutstandingToken.objects.bulk_create(
+            items.values(), batch_size=self.batch_size,
+            update_conflicts=True, unique_fields=["jti"], update_fields=["user"],
+        )
+
+
+outstanding_tokens = OutstandingTokenBuffer(
+    batch_size=settings.TOKEN_ISSUANCE["OUTSTANDING_BATCH_SIZE"],
+    flush_interval=settings.TOKEN_ISSUANCE["OUTSTANDING_FLUSH_INTERVAL"],
+)
@@ -0,0 +1,140 @@
+import base64
+import hashlib
+import json
+from typing import Any, Dict
+
+import jwt
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.translation import gettext_lazy as _
+from jwt import InvalidAlgorithmError, InvalidTokenError
+from jwt.algorithms import get_default_algorithms
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+ASYMMETRIC_ALGORITHMS = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "EdDSA"}
+# members hashed into the RFC 7638 thumbprint used as the kid
+THUMBPRINT_MEMBERS = {"RSA": ("e", "kty", "n"), "EC": ("crv", "kty", "x", "y"), "OKP": ("crv", "kty", "x")}
+
+
+class KeyRing:
+    """
+    Private keys parsed once at startup. The first key signs new tokens; the
+    others are retired keys that still verify tokens signed before a
+    rotation, and all of them are published in the JWKS document.
+    """
+
+    def __init__(self, algorithm: str, paths: list):
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ImproperlyConfigured(f"JWT_ALGORITHM {algorithm!r} is not an asymmetric algorithm")
+        if not paths:
+            raise ImproperlyConfigured(f"JWT_ALGORITHM {algorithm!r} requires JWT_PRIVATE_KEY_FILES")
+        self.algorithm = algorithm
+        self._algorithm = get_default_algorithms()[algorithm]
+        self.private_keys = {}
+        self.public_keys = {}
+        jwks = []
+        for path in paths:
+            with open(path, "rb") as key_file:
+                private_key = self._algorithm.prepare_key(key_file.read())
+            public_key = private_key.public_key()
+            jwk = self._algorithm.to_jwk(public_key, as_dict=True)
+            kid = self.thumbprint(jwk)
+            self.private_keys[kid] = private_key
+            self.public_keys[kid] = public_key
+            jwks.append({**jwk, "kid": kid, "alg": algorithm, "use": "sig"})
+        self.current_kid = next(iter(self.private_keys))
+        self.jwks = json.dumps({"keys": jwks}, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.jwks).hexdigest()[:32]}"'
+
+    @staticmethod
+    def thumbprint(jwk) -> str:
+        members = {name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk["kty"]]}
+        digest = hashlib.sha256(json.dumps(members, sort_keys=True, separators=(",", ":")).encode()).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    @property
+    def signing_key(self):
+        return self.private_keys[self.current_kid]
+
+    def verifying_key(self, kid):
+        try:
+            return self.public_keys[kid or self.current_kid]
+        except KeyError:
+            raise TokenBackendError(_("Token is invalid or expired"))
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Signs with the key ring's current key, names it in the ``kid`` header and
+    verifies with whichever published key the header names. Keys are passed
+    to PyJWT as already parsed objects, so no PEM is parsed per token.
+    """
+
+    def __init__(self, key_ring: KeyRing, **kwargs):
+        super().__init__(key_ring.algorithm, **kwargs)
+        self.key_ring = key_ring
+
+    def _validate_algorithm(self, algorithm: str) -> None:
+        # simplejwt does not list EdDSA; KeyRing has already checked it
+        pass
+
+    def encode(self, payload: Dict[str, Any]) -> str:
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        return jwt.encode(
+            jwt_payload,
+            self.key_ring.signing_key,
+            algorithm=self.algorithm,
+            headers={"kid": self.key_ring.current_kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify: bool = True) -> Dict[str, Any]:
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            return jwt.decode(
+                token,
+                self.key_ring.verifying_key(kid),
+                algorithms=[self.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    "verify_aud": self.audience is not None,
+                    "verify_signature": verify,
+                },
+            )
+        except InvalidAlgorithmError as ex:
+            raise TokenBackendError(_("Invalid algorithm specified")) from ex
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_("Token is invalid or expired")) from ex
+
+
+def get_key_ring():
+    if settings.JWT_SIGNING["ALGORITHM"].startswith("HS"):
+        return None
+    return KeyRing(settings.JWT_SIGNING["ALGORITHM"], settings.JWT_SIGNING["PRIVATE_KEY_FILES"])
+
+
+key_ring = get_key_ring()
+
+
+def get_token_backend():
+    """
+    The backend every simplejwt token class uses; None keeps simplejwt's own
+    HMAC backend.
+    """
+    if key_ring is None:
+        return None
+    return KeyRingTokenBackend(
+        key_ring,
+        audience=api_settings.AUDIENCE,
+        issuer=api_settings.ISSUER,
+        leeway=api_settings.LEEWAY,
+        json_encoder=api_settings.JSON_ENCODER,
+    )
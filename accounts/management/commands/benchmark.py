@@ -0,0 +1,257 @@
+import io
+import itertools
+import json
+import platform
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+
+from accounts.models import User
+from accounts.tokens import RefreshToken
+from core import metrics
+
+from .loadtest import latency_summary
+
+SCENARIOS = ("signup", "login", "refresh", "verify", "profile", "profile_update", "logout")
+USER_PREFIX = "bench-"
+PASSWORD = "Bench-pass-1"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the auth endpoints in-process through the WSGI handler against the configured "
+        "database, using seeded users and worker threads, and writes latency percentiles, "
+        "throughput and queries per request as JSON. --baseline compares with an earlier run "
+        "and fails on regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="users to seed (kept between runs)")
+        parser.add_argument("--concurrency", type=int, default=8, help="worker threads")
+        parser.add_argument("--requests", type=int, default=500, help="timed requests per scenario")
+        parser.add_argument("--warmup", type=int, default=20, help="untimed requests per scenario")
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument("--output", help="JSON file to write, defaults to stdout")
+        parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.2,
+            help="allowed relative p95 increase or throughput drop against --baseline",
+        )
+        parser.add_argument("--cleanup", action="store_true", help="delete the seeded users afterwards")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.run_id = uuid.uuid4().hex[:8]
+        self.handler = WSGIHandler()
+        self.users = self.seed(options["users"])
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.signups = itertools.count()
+        # the benchmark measures the endpoints, not the rate limits in front of them
+        rates = {scope: None for scope in settings.REST_FRAMEWORK.get("DEFAULT_THROTTLE_RATES", {})}
+        try:
+            with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": rates}):
+                results = {scenario: self.run_scenario(scenario) for scenario in options["scenarios"]}
+        finally:
+            User.objects.filter(username__startswith=f"{USER_PREFIX}signup-{self.run_id}-").delete()
+            if options["cleanup"]:
+                User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+        report = {"meta": self.meta(), "scenarios": results}
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline:
+                report["regressions"] = self.compare(json.load(baseline), results, options["tolerance"])
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if report.get("regressions"):
+            raise CommandError("\n".join(report["regressions"]))
+
+    def seed(self, count):
+        """
+        Creates the missing bench-N users through UserManager. They share one
+        password hash, so seeding hashes a single password.
+        """
+        existing = set(User.objects.filter(username__startswith=USER_PREFIX).values_list("username", flat=True))
+        created = []
+        for number in range(count):
+            username = f"{USER_PREFIX}{number}"
+            if username not in existing:
+                created.append(User.objects.create_user(username=username, email=f"{username}@bench.example"))
+        if created:
+            User.objects.filter(pk__in=[user.pk for user in created]).update(password=make_password(PASSWORD))
+        return list(User.objects.filter(username__in=[f"{USER_PREFIX}{number}" for number in range(count)]))
+
+    def call(self, method, path, body=None, token=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "HTTP_HOST": "localhost",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(payload),
+            "CONTENT_LENGTH": str(len(payload)),
+            "CONTENT_TYPE": "application/json",
+            "HTTP_ACCEPT": "application/json",
+        }
+        if token:
+            environ["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        status = []
+        response = self.handler(environ, lambda status_line, headers, *args: status.append(int(status_line[:3])))
+        try:
+            content = b"".join(response)
+        finally:
+            # sends request_finished, which returns the database connection
+            response.close()
+        return status[0], json.loads(content) if content else None
+
+    def token_pair(self, user):
+        refresh = RefreshToken.for_user(user)
+        return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+    def prepare(self, scenario, worker, number):
+        """The (method, path, body, token) of one request; runs outside the timing."""
+        user = self.users[(worker + number * self.options["concurrency"]) % len(self.users)]
+        if scenario == "signup":
+            username = f"{USER_PREFIX}signup-{self.run_id}-{next(self.signups)}"
+            body = {"username": username, "email": f"{username}@bench.example", "password": PASSWORD}
+            return "POST", reverse("accounts:signup_user"), body, None
+        if scenario == "login":
+            return "POST", reverse("accounts:login"), {"email": user.email, "password": PASSWORD}, None
+        if scenario == "logout":
+            # every logout blacklists its refresh token, so each needs a new pair
+            tokens = self.token_pair(user)
+            return "POST", reverse("accounts:logout"), {"refresh": tokens["refresh"]}, tokens["access"]
+        with self.lock:
+            if (scenario, worker) not in self.tokens:
+                self.tokens[(scenario, worker)] = self.token_pair(self.users[worker % len(self.users)])
+            # copied, worker() replaces the refresh token after a rotation
+            tokens = dict(self.tokens[(scenario, worker)])
+        if scenario == "refresh":
+            return "POST", reverse("accounts:token_refresh"), {"refresh": tokens["refresh"]}, None
+        if scenario == "verify":
+            return "POST", reverse("accounts:token_verify"), {"token": tokens["access"]}, None
+        if scenario == "profile":
+            return "GET", reverse("accounts:user_me"), None, tokens["access"]
+        return "PATCH", reverse("accounts:user_me"), {"first_name": f"Bench {number}"}, tokens["access"]
+
+    def worker(self, scenario, worker, count, latencies, errors):
+        for number in range(count):
+            method, path, body, token = self.prepare(scenario, worker, number)
+            started = time.perf_counter()
+            status, data = self.call(method, path, body, token)
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if scenario == "refresh" and status == 200 and "refresh" in data:
+                    # rotation retires the old refresh token
+                    self.tokens[(scenario, worker)]["refresh"] = data["refresh"]
+                if latencies is None:
+                    continue
+                if status < 400:
+                    latencies.append(elapsed)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    def run_workers(self, scenario, total, latencies, errors):
+        concurrency = self.options["concurrency"]
+        counts = [total // concurrency + (1 if worker < total % concurrency else 0) for worker in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(self.worker, scenario, worker, count, latencies, errors)
+                for worker, count in enumerate(counts)
+            ]
+            for future in futures:
+                future.result()
+
+    def db_totals(self, endpoint):
+        labels = (("endpoint", endpoint),)
+        queries = metrics.registry.histograms.get(("request_db_queries", labels))
+        seconds = metrics.registry.histograms.get(("request_db_seconds", labels))
+        if queries is None:
+            return 0, 0.0, 0
+        return queries.sum, seconds.sum, queries.count
+
+    def run_scenario(self, scenario):
+        self.run_workers(scenario, self.options["warmup"], None, None)
+        method, path, _, _ = self.prepare(scenario, 0, 0)
+        endpoint = resolve(path).view_name
+        queries_before, db_before, count_before = self.db_totals(endpoint)
+        latencies, errors = [], {}
+        started = time.perf_counter()
+        self.run_workers(scenario, self.options["requests"], latencies, errors)
+        elapsed = time.perf_counter() - started
+        queries_after, db_after, count_after = self.db_totals(endpoint)
+
+        result = {
+            "endpoint": endpoint,
+            "method": method,
+            "requests": len(latencies),
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+        }
+        if len(latencies) >= 2:
+            result["latency_ms"] = latency_summary(latencies)
+        measured = count_after - count_before
+        if measured:
+            # from core.metrics, so only with METRICS["ENABLED"]
+            result["queries_per_request"] = round((queries_after - queries_before) / measured, 2)
+            result["db_ms_per_request"] = round((db_after - db_before) / measured * 1000, 3)
+        self.stderr.write(f"{scenario}: {result['requests_per_second']} req/s, {result.get('latency_ms')}")
+        return result
+
+    def meta(self):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "users": len(self.users),
+            "concurrency": self.options["concurrency"],
+            "requests": self.options["requests"],
+        }
+
+    @staticmethod
+    def compare(baseline, results, tolerance):
+        regressions = []
+        for scenario, result in results.items():
+            before = baseline.get("scenarios", {}).get(scenario)
+            if not before:
+                continue
+            if "latency_ms" in result and "latency_ms" in before:
+                if result["latency_ms"]["p95"] > before["latency_ms"]["p95"] * (1 + tolerance):
+                    regressions.append(
+                        f"{scenario}: p95 {before['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms"
+                    )
+            if result["requests_per_second"] < before["requests_per_second"] * (1 - tolerance):
+                regressions.append(
+                    f"{scenario}: {before['requests_per_second']} -> {result['requests_per_second']} req/s"
+                )
+            if result.get("queries_per_request", 0) > before.get("queries_per_request", float("inf")):
+                regressions.append(
+                    f"{scenario}: {before['queries_per_request']} -> {result['queries_per_request']} queries/request"
+                )
+        return regressions
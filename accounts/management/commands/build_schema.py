@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.schema import schema_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the OpenAPI schema served at schema/ and schema_json/ into SCHEMA_DIR for the "
+        "current code version, so servers load it instead of generating it"
+    )
+
+    def handle(self, *args, **kwargs):
+        if schema_cache.directory is None:
+            raise CommandError("SCHEMA_DIR is not set")
+        built = schema_cache.build()
+        self.stdout.write(f"Built {len(built)} schema documents in {schema_cache.directory / schema_cache.version}")
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from accounts.export import CHUNK_SIZE, FORMATS, export_users
+
+
+class Command(BaseCommand):
+    help = "Streams all users as NDJSON or CSV to a file or stdout, with constant memory use"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(FORMATS), default="ndjson")
+        parser.add_argument("--output", "-o", help="defaults to stdout")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = export_users(options["format"], gzip=options["gzip"], chunk_size=options["chunk_size"])
+        if not options["output"]:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(options["output"], "wb") as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import TokenFamily
+
+
+class Command(BaseCommand):
+    help = "Deletes expired and revoked refresh token families from the database"
+
+    def handle(self, *args, **kwargs):
+        # a missing family is as invalid as a revoked one, so both can go
+        deleted, _ = TokenFamily.objects.filter(Q(expires_at__lte=timezone.now()) | Q(revoked_at__isnull=False)).delete()
+        self.stdout.write(f"Deleted {deleted} token families")
@@ -0,0 +1,178 @@
+import csv
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.utils.field_mapping import get_unique_error_message
+
+from accounts.models import User
+from accounts.serializers import AccountSerializer, UserCreateSerializer
+
+UNIQUE_FIELDS = UserCreateSerializer.unique_fields
+# minimum lengths the account endpoints enforce and UserCreateSerializer lacks
+LENGTH_CHECKED_FIELDS = ("username", "first_name", "last_name", "middle_name", "password")
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports users from a CSV or JSONL file (or '-' for stdin). Rows are validated with "
+        "UserCreateSerializer's field rules and written with bulk_create; rejected rows go to "
+        "--reject-file with their errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=("csv", "jsonl"), help="defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--offset", type=int, default=0, help="number of data rows to skip, to resume an import")
+        parser.add_argument("--reject-file", help="JSONL file that receives rejected rows")
+        parser.add_argument("--hashed", action="store_true", help="the password column already holds Django hashes")
+        parser.add_argument("--workers", type=int, default=None, help="password hashing processes")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or ("jsonl" if options["path"].endswith((".jsonl", ".ndjson")) else "csv")
+        if options["path"] == "-" and not options["format"]:
+            raise CommandError("--format is required when reading from stdin")
+        self.batch_size = options["batch_size"]
+        self.hashed = options["hashed"]
+        self.pool = None
+        if not self.hashed:
+            self.pool = ProcessPoolExecutor(max_workers=options["workers"], mp_context=multiprocessing.get_context("spawn"))
+        self.rejects = open(options["reject_file"], "a") if options["reject_file"] else None
+        self.imported = self.rejected = 0
+
+        source = sys.stdin if options["path"] == "-" else open(options["path"], newline="")
+        started = time.perf_counter()
+        offset = options["offset"]
+        try:
+            batch = []
+            for number, row in enumerate(self.read_rows(source, fmt)):
+                if number < offset:
+                    continue
+                batch.append((number, row))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    self.report(batch[-1][0] + 1, started)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+                self.report(batch[-1][0] + 1, started)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if self.rejects:
+                self.rejects.close()
+            if self.pool:
+                self.pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        total = self.imported + self.rejected
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} users, rejected {self.rejected} in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+
+    def read_rows(self, source, fmt):
+        if fmt == "csv":
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+    def report(self, next_offset, started):
+        elapsed = time.perf_counter() - started
+        done = self.imported + self.rejected
+        self.stdout.write(
+            f"offset={next_offset} imported={self.imported} rejected={self.rejected} "
+            f"({done / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+
+    def reject(self, number, row, errors):
+        self.rejected += 1
+        if self.rejects:
+            self.rejects.write(json.dumps({"row": number, "data": row, "errors": errors}, default=str, ensure_ascii=False) + "\n")
+
+    def validate(self, row):
+        data = {key: value for key, value in row.items() if value not in ("", None)}
+        # field rules only; uniqueness is checked once per batch below
+        validated = UserCreateSerializer().to_internal_value(data)
+        errors = {}
+        for name in LENGTH_CHECKED_FIELDS:
+            if name not in validated or (name == "password" and self.hashed):
+                continue
+            try:
+                AccountSerializer._declared_fields[name].run_validation(validated[name])
+            except serializers.ValidationError as e:
+                errors[name] = e.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+        if self.hashed:
+            try:
+                identify_hasher(validated["password"])
+            except ValueError:
+                raise serializers.ValidationError({"password": ["unknown password hash format"]})
+        validated["email"] = User.objects.normalize_email(validated.get("email"))
+        return validated
+
+    def import_batch(self, batch):
+        valid = []
+        for number, row in batch:
+            try:
+                valid.append((number, row, self.validate(row)))
+            except serializers.ValidationError as e:
+                self.reject(number, row, e.detail)
+
+        valid = self.drop_duplicates(valid)
+        passwords = [data["password"] for _, _, data in valid]
+        if not self.hashed:
+            passwords = self.pool.map(make_password, passwords, chunksize=max(1, len(passwords) // 32))
+        users = [User(**{**data, "password": password}) for (_, _, data), password in zip(valid, passwords)]
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users, batch_size=self.batch_size)
+            self.imported += len(users)
+        except IntegrityError:
+            # a concurrent signup took one of the values; fall back to row by row
+            for (number, row, _), user in zip(valid, users):
+                try:
+                    with transaction.atomic():
+                        user.save(force_insert=True)
+                    self.imported += 1
+                except IntegrityError as e:
+                    self.reject(number, row, {"non_field_errors": [str(e)]})
+
+    def drop_duplicates(self, valid):
+        lookups = Q()
+        for name in UNIQUE_FIELDS:
+            values = [data[name] for _, _, data in valid if data.get(name)]
+            if values:
+                lookups |= Q(**{f"{name}__in": values})
+        taken = {name: set() for name in UNIQUE_FIELDS}
+        if lookups:
+            for row in User.objects.filter(lookups).values(*UNIQUE_FIELDS):
+                for name in UNIQUE_FIELDS:
+                    taken[name].add(row[name])
+
+        result = []
+        for number, row, data in valid:
+            errors = {
+                name: [get_unique_error_message(User._meta.get_field(name))]
+                for name in UNIQUE_FIELDS if data.get(name) and data[name] in taken[name]
+            }
+            if errors:
+                self.reject(number, row, errors)
+                continue
+            for name in UNIQUE_FIELDS:
+                if data.get(name):
+                    taken[name].add(data[name])
+            result.append((number, row, data))
+        return result
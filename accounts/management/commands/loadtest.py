@@ -0,0 +1,158 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+SCENARIOS = ("login", "refresh", "verify", "profile")
+PREFIX = "/api/v1/auth/"
+
+
+def latency_summary(latencies) -> dict:
+    """p50/p95/p99/max in milliseconds of at least two latencies in seconds."""
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50": round(percentiles[49] * 1000, 2),
+        "p95": round(percentiles[94] * 1000, 2),
+        "p99": round(percentiles[98] * 1000, 2),
+        "max": round(max(latencies) * 1000, 2),
+    }
+
+
+class Connection:
+    """
+    One keep-alive HTTP/1.1 connection; enough of the protocol for JSON
+    requests against this API.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, token=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        headers = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Accept: application/json",
+            "Content-Type: application/json",
+            f"Content-Length: {len(payload)}",
+        ]
+        if token:
+            headers.append(f"Authorization: Bearer {token}")
+        self.writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            self.writer = None
+            raise ConnectionError("connection closed")
+        status = int(status_line.split()[1])
+        length = 0
+        close = False
+        while True:
+            line = (await self.reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection" and value.strip().lower() == "close":
+                close = True
+        data = await self.reader.readexactly(length) if length else b""
+        if close:
+            self.writer.close()
+            self.writer = None
+        return status, json.loads(data) if data else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives concurrent load against a running server (e.g. the same code under gunicorn "
+        "with core.wsgi and under uvicorn with core.asgi) and reports throughput and latency "
+        "for login, refresh, verify or profile requests. Raise the THROTTLE_RATE_* settings "
+        "on the server first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--scenario", choices=SCENARIOS, default="login")
+        parser.add_argument("--email", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["url"])
+        self.host, self.port = url.hostname, url.port or 80
+        self.options = options
+        result = asyncio.run(self.run())
+        self.stdout.write(json.dumps(result, indent=2))
+
+    async def login(self, connection):
+        for _ in range(10):
+            status, data = await connection.request(
+                "POST", f"{PREFIX}login/", {"email": self.options["email"], "password": self.options["password"]},
+            )
+            if status == 200:
+                return data
+            if status not in (429, 503):
+                break
+            # the hashing pool or a throttle is full; back off and retry
+            await asyncio.sleep(1)
+        raise CommandError(f"login failed with {status}: {data}")
+
+    async def worker(self, deadline, latencies, errors):
+        connection = Connection(self.host, self.port)
+        scenario = self.options["scenario"]
+        tokens = await self.login(connection) if scenario != "login" else None
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if scenario == "login":
+                    status, data = await connection.request(
+                        "POST", f"{PREFIX}login/",
+                        {"email": self.options["email"], "password": self.options["password"]},
+                    )
+                elif scenario == "refresh":
+                    status, data = await connection.request("POST", f"{PREFIX}login/refresh/", {"refresh": tokens["refresh"]})
+                    if status == 200 and "refresh" in data:
+                        tokens["refresh"] = data["refresh"]
+                elif scenario == "verify":
+                    status, data = await connection.request("POST", f"{PREFIX}login/verify/", {"token": tokens["access"]})
+                else:
+                    status, data = await connection.request("GET", f"{PREFIX}profile/", token=tokens["access"])
+            except (ConnectionError, asyncio.IncompleteReadError):
+                errors["connection"] = errors.get("connection", 0) + 1
+                connection = Connection(self.host, self.port)
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    async def run(self):
+        latencies, errors = [], {}
+        started = time.perf_counter()
+        deadline = started + self.options["duration"]
+        await asyncio.gather(*(
+            self.worker(deadline, latencies, errors) for _ in range(self.options["concurrency"])
+        ))
+        elapsed = time.perf_counter() - started
+        result = {
+            "url": self.options["url"],
+            "scenario": self.options["scenario"],
+            "concurrency": self.options["concurrency"],
+            "seconds": round(elapsed, 2),
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "errors": {str(key): count for key, count in errors.items()},
+        }
+        if len(latencies) >= 2:
+            result["latency_ms"] = latency_summary(latencies)
+        return result
@@ -0,0 +1,27 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.notifications import dispatcher
+
+
+class Command(BaseCommand):
+    help = "Runs notification worker threads that drain the shared (redis) notification queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.NOTIFICATIONS["WORKERS"])
+
+    def handle(self, *args, **options):
+        if settings.NOTIFICATIONS["QUEUE"] != "redis":
+            raise CommandError("NOTIFICATIONS_QUEUE=local is drained inside each web process; use redis to run workers")
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+        dispatcher.start(options["workers"])
+        self.stdout.write(f"Started {options['workers']} notification workers")
+        try:
+            stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        dispatcher.stop()
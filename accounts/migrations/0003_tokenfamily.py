@@ -0,0 +1,30 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user__uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenFamily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('revoked_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отзыва')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_families', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Сессия',
+                'verbose_name_plural': 'Сессии',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_tokenfamily'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_login',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последнее соединение'),
+        ),
+    ]
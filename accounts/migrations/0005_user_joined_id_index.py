@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_last_login'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id_idx'),
+        ),
+    ]
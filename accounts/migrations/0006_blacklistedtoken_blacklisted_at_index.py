@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    accounts.revocation syncs the blacklist by ``blacklisted_at``, which
+    simplejwt does not index.
+    """
+
+    dependencies = [
+        ('accounts', '0005_user_joined_id_index'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS accounts_blacklisted_at_idx '
+            'ON token_blacklist_blacklistedtoken (blacklisted_at)',
+            'DROP INDEX IF EXISTS accounts_blacklisted_at_idx',
+        ),
+    ]
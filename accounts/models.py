@@ -7,6 +7,8 @@ from django.contrib.auth.models import (
 from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
 
+from . import hashing
+
 
 class UserManager(BaseUserManager):
 
@@ -68,8 +70,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     last_name = models.CharField("Имя", max_length=100, blank=True, null=True)
     middle_name = models.CharField("Отчество", max_length=100, null=True, blank=True)
     date_joined = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    # written in batches by accounts.activity.last_login_buffer
     last_login = models.DateTimeField(
-        verbose_name="Последнее соединение", auto_now=True
+        verbose_name="Последнее соединение", null=True, blank=True
     )
 
     is_active = models.BooleanField(default=True)
@@ -95,6 +98,26 @@ class User(AbstractBaseUser, PermissionsMixin):
     def has_module_perms(self, app_label):  # give permission to module
         return True  # instead of True we can give access to specific position (eg: is_admin, is_staff or both)
 
+    # hashing runs in the accounts.hashing process pool, not on the request thread
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        valid, must_update = hashing.check_password(raw_password, self.password)
+        if valid and must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return valid
+
+    async def acheck_password(self, raw_password):
+        valid, must_update = await hashing.acheck_password(raw_password, self.password)
+        if valid and must_update:
+            self.password = await hashing.amake_password(raw_password)
+            await self.asave(update_fields=["password"])
+        return valid
+
     @property
     def get_full_name(self):
         return f"{self.first_name} {self.last_name} {self.middle_name}"
@@ -102,3 +125,27 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            # keyset pagination in accounts.pagination.KeysetPagination
+            models.Index(fields=["date_joined", "id"], name="accounts_user_joined_id_idx"),
+        ]
+
+
+class TokenFamily(models.Model):
+    """
+    One row per login session. Every refresh token of the session carries the
+    family id and a generation; rotating bumps the generation, so presenting
+    an older generation again means the token was stolen or replayed.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="token_families")
+    generation = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+    revoked_at = models.DateTimeField(verbose_name="Дата отзыва", null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}:{self.pk} (gen {self.generation})"
+
+    class Meta:
+        verbose_name = "Сессия"
+        verbose_name_plural = "Сессии"
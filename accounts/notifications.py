@@ -0,0 +1,262 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+# Backends deliver a batch of messages for one channel and return the ones
+# that failed; raising marks the whole batch as failed.
+
+class ConsoleBackend:
+    def __init__(self, stream=None, **options):
+        self.stream = stream or sys.stdout
+
+    def send_messages(self, messages):
+        for message in messages:
+            self.stream.write(f"[{message['channel']}] to={message['to']} {message['subject']}: {message['body']}\n")
+        self.stream.flush()
+        return []
+
+
+class FileBackend:
+    def __init__(self, path="logs/notifications.jsonl", **options):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self._lock, open(self.path, "a") as output:
+            for message in messages:
+                output.write(json.dumps(message, ensure_ascii=False) + "\n")
+        return []
+
+
+class EmailBackend:
+    """
+    Sends a batch over a single connection of Django's EMAIL_BACKEND.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def send_messages(self, messages):
+        failed = []
+        with mail.get_connection(**self.options) as connection:
+            for message in messages:
+                try:
+                    mail.EmailMessage(message["subject"], message["body"], None, [message["to"]],
+                                      connection=connection).send()
+                except Exception:
+                    logger.exception("Failed to send email to %s", message["to"])
+                    failed.append(message)
+        return failed
+
+
+class LocalQueue:
+    """
+    In-process queue, drained by worker threads of the same process.
+    """
+
+    def __init__(self, dead_letters: int = 1000):
+        self._queue = queue.Queue()
+        self.dead_letters = deque(maxlen=dead_letters)
+
+    def put(self, message, delay=0):
+        if delay:
+            timer = threading.Timer(delay, self._queue.put, [message])
+            timer.daemon = True
+            timer.start()
+        else:
+            self._queue.put(message)
+
+    def get_batch(self, size, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def dead_letter(self, message):
+        self.dead_letters.append(message)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+class RedisQueue:
+    """
+    Queue in a Redis list shared by all web workers, drained by
+    ``manage.py run_notifications``. Retries wait in a sorted set scored by
+    their due time; exhausted messages are pushed to a dead-letter list.
+    """
+
+    def __init__(self, url: str, name: str = "notifications"):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("NOTIFICATIONS QUEUE 'redis' requires the redis package")
+        self.redis = redis.Redis.from_url(url)
+        self.key = name
+        self.delayed_key = f"{name}:delayed"
+        self.dead_key = f"{name}:dead"
+
+    def put(self, message, delay=0):
+        payload = json.dumps(message)
+        if delay:
+            self.redis.zadd(self.delayed_key, {payload: time.time() + delay})
+        else:
+            self.redis.lpush(self.key, payload)
+
+    def _promote_due(self):
+        for payload in self.redis.zrangebyscore(self.delayed_key, 0, time.time()):
+            # only the worker that removes it re-queues it
+            if self.redis.zrem(self.delayed_key, payload):
+                self.redis.lpush(self.key, payload)
+
+    def get_batch(self, size, timeout):
+        self._promote_due()
+        item = self.redis.brpop(self.key, timeout=max(1, int(timeout)))
+        if item is None:
+            return []
+        payloads = [item[1]]
+        if size > 1:
+            payloads += self.redis.rpop(self.key, size - 1) or []
+        return [json.loads(payload) for payload in payloads]
+
+    def dead_letter(self, message):
+        self.redis.lpush(self.dead_key, json.dumps(message))
+
+    def __len__(self):
+        return self.redis.llen(self.key)
+
+
+class Dispatcher:
+    """
+    Takes outbound messages off the request path: ``enqueue()`` only puts the
+    message on the queue, and worker threads deliver it in batches per
+    channel, retrying failures with exponential backoff and dead-lettering
+    messages that fail ``max_retries`` times.
+    """
+
+    def __init__(self, queue, backends: dict, batch_size: int, max_retries: int, backoff: float):
+        self.queue = queue
+        self.backend_settings = backends
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._backends = {}
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.sent = self.retried = self.dead_lettered = 0
+
+    def get_backend(self, channel):
+        if channel not in self._backends:
+            options = dict(self.backend_settings[channel])
+            self._backends[channel] = import_string(options.pop("BACKEND"))(**options)
+        return self._backends[channel]
+
+    def enqueue(self, channel: str, to: str, subject: str, body: str):
+        if not self.backend_settings.get(channel, {}).get("BACKEND"):
+            raise ImproperlyConfigured(f"No notification backend for channel {channel!r}")
+        self.queue.put({"channel": channel, "to": to, "subject": subject, "body": body, "attempts": 0})
+
+    def process_batch(self, messages):
+        by_channel = {}
+        for message in messages:
+            by_channel.setdefault(message["channel"], []).append(message)
+        for channel, batch in by_channel.items():
+            try:
+                failed = self.get_backend(channel).send_messages(batch)
+            except Exception:
+                logger.exception("Notification backend for %s failed", channel)
+                failed = batch
+            self.sent += len(batch) - len(failed)
+            for message in failed:
+                self.retry(message)
+
+    def retry(self, message):
+        message["attempts"] += 1
+        if message["attempts"] > self.max_retries:
+            logger.error("Dead-lettering %s notification to %s", message["channel"], message["to"])
+            self.queue.dead_letter(message)
+            self.dead_lettered += 1
+            return
+        self.retried += 1
+        self.queue.put(message, delay=self.backoff ** message["attempts"])
+
+    def run(self, timeout: float = 1.0, max_delay: float = 30.0):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                batch = self.queue.get_batch(self.batch_size, timeout)
+                if batch:
+                    self.process_batch(batch)
+            except Exception:
+                # e.g. the redis queue is unreachable; keep the worker alive
+                failures += 1
+                delay = min(self.backoff ** failures, max_delay)
+                logger.exception("Notification worker failed, retrying in %.1fs", delay)
+                self._stop.wait(delay)
+            else:
+                failures = 0
+
+    def start(self, workers: int):
+        with self._lock:
+            self._stop.clear()
+            while len(self._workers) < workers:
+                worker = threading.Thread(target=self.run, name=f"notifications-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "workers": len(self._workers),
+        }
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+
+def get_queue():
+    if settings.NOTIFICATIONS["QUEUE"] == "redis":
+        return RedisQueue(settings.NOTIFICATIONS["REDIS_URL"])
+    return LocalQueue()
+
+
+dispatcher = Dispatcher(
+    queue=get_queue(),
+    backends=settings.NOTIFICATIONS["BACKENDS"],
+    batch_size=settings.NOTIFICATIONS["BATCH_SIZE"],
+    max_retries=settings.NOTIFICATIONS["MAX_RETRIES"],
+    backoff=settings.NOTIFICATIONS["RETRY_BACKOFF"],
+)
+
+
+def notify(channel: str, to: str, subject: str, body: str):
+    dispatcher.enqueue(channel, to, subject, body)
+    if settings.NOTIFICATIONS["QUEUE"] == "local":
+        # nobody else drains an in-process queue
+        dispatcher.start(settings.NOTIFICATIONS["WORKERS"])
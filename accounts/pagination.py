@@ -0,0 +1,109 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages through users newest first by ``(date_joined, id)`` using the
+    composite index on those columns. The cursor holds the last row of the
+    previous page, so page N costs the same index range scan as page 1 and
+    no COUNT(*) is run. ``?estimate=1`` adds the planner's row estimate.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("-date_joined", "-id")
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, api_settings.PAGE_SIZE))
+        except ValueError:
+            page_size = api_settings.PAGE_SIZE
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, instance):
+        position = [instance.date_joined.isoformat(), instance.pk]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            date_joined, pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            date_joined = parse_datetime(date_joined)
+            if date_joined is None or not isinstance(pk, int):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise exceptions.NotFound("Invalid cursor")
+        return date_joined, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.estimate = request.query_params.get("estimate") in ("1", "true")
+        self.model = queryset.model
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            date_joined, pk = position
+            # the redundant lte gives the planner a plain range on the index
+            queryset = queryset.filter(
+                Q(date_joined__lt=date_joined) | Q(date_joined=date_joined, pk__lt=pk),
+                date_joined__lte=date_joined,
+            )
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_estimated_total(self):
+        connection = connections[self.model.objects.db]
+        if connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [self.model._meta.db_table])
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else None
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([("next", self.get_next_link())])
+        if self.estimate:
+            response["estimated_total"] = self.get_estimated_total()
+        response["results"] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "estimated_total": {"type": "integer", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {"name": self.cursor_query_param, "required": False, "in": "query", "schema": {"type": "string"}},
+            {"name": self.page_size_query_param, "required": False, "in": "query", "schema": {"type": "integer"}},
+            {"name": "estimate", "required": False, "in": "query", "schema": {"type": "boolean"}},
+        ]
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from rest_framework import permissions
+
+
+class HasGatewayToken(permissions.BasePermission):
+    """
+    Lets in callers that send INTROSPECTION["TOKEN"] in ``X-Gateway-Token``.
+    Nobody gets in this way while the token is unset.
+    """
+
+    def has_permission(self, request, view):
+        token = settings.INTROSPECTION["TOKEN"]
+        return bool(token) and constant_time_compare(request.headers.get("X-Gateway-Token", ""), token)
@@ -0,0 +1,57 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from .models import User
+from .notifications import notify
+
+
+class ResetTokenGenerator(PasswordResetTokenGenerator):
+    """
+    Stateless reset tokens: the timestamp and an HMAC over the user's
+    ``_uuid``, current password hash and that timestamp. Setting a new
+    password changes the hash and so invalidates every token issued before,
+    without a reset-token table. ``last_login`` is left out because it is
+    written behind by accounts.activity.
+    """
+
+    key_salt = "accounts.reset.ResetTokenGenerator"
+
+    def _make_hash_value(self, user, timestamp):
+        return f"{user._uuid}{user.password}{timestamp}"
+
+
+reset_tokens = ResetTokenGenerator()
+# stands in for a missing user so both request branches do the same work
+_dummy_user = User(_uuid=uuid.UUID(int=0), password="")
+
+
+def encode_uid(user) -> str:
+    return urlsafe_base64_encode(user._uuid.bytes)
+
+
+def get_user_by_uid(uid: str):
+    """
+    One lookup on the unique ``_uuid`` index; None for malformed uids.
+    """
+    try:
+        _uuid = uuid.UUID(bytes=urlsafe_base64_decode(uid))
+    except (TypeError, ValueError):
+        return None
+    return User.objects.filter(_uuid=_uuid, is_active=True).first()
+
+
+def request_reset(email: str):
+    """
+    Queues a reset link for the active user with ``email``, if any. The
+    caller answers the same way either way, and the token is minted for a
+    dummy user when nobody matches so the timing does not reveal it either.
+    """
+    user = User.objects.filter(email=User.objects.normalize_email(email), is_active=True).first()
+    token = reset_tokens.make_token(user or _dummy_user)
+    if user is None:
+        return
+    link = settings.PASSWORD_RESET_URL.format(uid=encode_uid(user), token=token)
+    notify("email", user.email, "Password reset", f"Follow this link to set a new password: {link}")
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter sized for ``capacity`` items at ``error_rate``
+    false positives. Membership tests never give false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationIndex:
+    """
+    In-process index of blacklisted jti values.
+
+    The filter is fed incrementally from BlacklistedToken by
+    ``blacklisted_at`` (indexed by migration 0006). Each sync re-reads the
+    rows stamped up to ``sync_margin`` seconds before the newest one already
+    seen, so rows committed late or stamped by a host with a skewed clock
+    are still picked up. A jti that is not in the filter is not blacklisted
+    (as of the last sync); a hit is confirmed against the database, so false
+    positives only cost a query.
+
+    After ``start()`` the full scans that build the filter run in a
+    background thread, and checks go to the database until the filter is
+    ready. Without it (tests, management commands) the first check builds
+    the filter inline.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, sync_interval: float, sync_margin: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.sync_margin = timedelta(seconds=sync_margin)
+        self.background = False
+        self.checks = 0
+        self.db_checks = 0
+        self.false_positives = 0
+        self._filter = None
+        self._watermark = None
+        self._synced_at = 0.0
+        self._building = False
+        self._syncing = False
+        self._build_started_at = float("-inf")
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # a build thread does not survive fork()
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        """Builds the filter in the background now and whenever it fills up."""
+        self.background = True
+        self._start_build()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._syncing = False
+        if self._building:
+            self._building = False
+            if self.background:
+                self._start_build()
+
+    def _scan(self, add, watermark):
+        """
+        Passes the jtis blacklisted since ``watermark`` minus the margin (all
+        of them without one) to ``add``; returns the new watermark.
+        """
+        rows = BlacklistedToken.objects.order_by()
+        if watermark is not None:
+            rows = rows.filter(blacklisted_at__gte=watermark - self.sync_margin)
+        for jti, blacklisted_at in rows.values_list("token__jti", "blacklisted_at").iterator(chunk_size=10000):
+            add(jti)
+            if watermark is None or blacklisted_at > watermark:
+                watermark = blacklisted_at
+        return watermark
+
+    def _start_build(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._building:
+                return
+            if self._filter is None and now - self._build_started_at < self.sync_interval:
+                # the last build failed; checks use the database until the retry
+                return
+            self._building = True
+            self._build_started_at = now
+        if self.background:
+            threading.Thread(target=self._build, name="revocation-index-build", daemon=True).start()
+        else:
+            self._build()
+
+    def _build(self):
+        try:
+            capacity = self.capacity
+            if self._filter is not None:
+                capacity = max(capacity, self._filter.count * 2)
+            bloom = BloomFilter(capacity, self.error_rate)
+            started = time.monotonic()
+            watermark = self._scan(bloom.add, None)
+            with self._lock:
+                self._filter = bloom
+                self._watermark = watermark
+                self._synced_at = started
+        except Exception:
+            logger.exception("Failed to build the revocation index")
+        finally:
+            self._building = False
+            if self.background:
+                connections.close_all()
+
+    def sync(self):
+        """
+        Brings the filter up to date unless another thread is doing so or just
+        did. The query runs without the lock; only merging its rows into the
+        filter holds it.
+        """
+        with self._lock:
+            if (
+                self._filter is None
+                or self._syncing
+                or time.monotonic() - self._synced_at < self.sync_interval
+            ):
+                return
+            self._syncing = True
+            watermark = self._watermark
+        try:
+            started = time.monotonic()
+            found = []
+            watermark = self._scan(found.append, watermark)
+            with self._lock:
+                # a rebuild may have swapped the filter meanwhile; the rows
+                # are merged into whichever one is current
+                bloom = self._filter
+                if bloom is None:
+                    # reset() meanwhile; the next check rebuilds
+                    return
+                for jti in found:
+                    if jti not in bloom:
+                        bloom.add(jti)
+                if self._watermark is None or watermark > self._watermark:
+                    self._watermark = watermark
+                self._synced_at = max(self._synced_at, started)
+                full = bloom.count > bloom.capacity
+        finally:
+            self._syncing = False
+        if full:
+            # the old filter keeps answering, with more false positives, meanwhile
+            self._start_build()
+
+    def add(self, jti: str):
+        with self._lock:
+            if self._filter is not None and jti not in self._filter:
+                self._filter.add(jti)
+
+    def might_contain(self, jti: str) -> bool:
+        if self._filter is None:
+            self._start_build()
+        elif time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        bloom = self._filter
+        return bloom is None or jti in bloom
+
+    def is_revoked(self, jti: str) -> bool:
+        self.checks += 1
+        if not self.might_contain(jti):
+            return False
+        self.db_checks += 1
+        revoked = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    async def ais_revoked(self, jti: str) -> bool:
+        # a fresh filter that rules the jti out needs no thread hop
+        bloom = self._filter
+        if bloom is not None and time.monotonic() - self._synced_at < self.sync_interval:
+            if jti not in bloom:
+                self.checks += 1
+                return False
+        return await sync_to_async(self.is_revoked)(jti)
+
+    def revoked(self, jtis) -> set:
+        """
+        Set-wise ``is_revoked``: the jtis the filter may contain are confirmed
+        with one ``IN`` query.
+        """
+        jtis = set(jtis)
+        self.checks += len(jtis)
+        candidates = [jti for jti in jtis if self.might_contain(jti)]
+        if not candidates:
+            return set()
+        self.db_checks += len(candidates)
+        revoked = set(BlacklistedToken.objects.filter(token__jti__in=candidates).values_list("token__jti", flat=True))
+        self.false_positives += len(candidates) - len(revoked)
+        return revoked
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._watermark = None
+            self._synced_at = 0.0
+            self._build_started_at = float("-inf")
+
+    def stats(self) -> dict:
+        return {
+            "checks": self.checks,
+            "db_checks": self.db_checks,
+            "false_positives": self.false_positives,
+            "size": self._filter.count if self._filter is not None else 0,
+            "building": int(self._building),
+        }
+
+
+revocation_index = RevocationIndex(
+    capacity=settings.REVOCATION_INDEX["CAPACITY"],
+    error_rate=settings.REVOCATION_INDEX["ERROR_RATE"],
+    sync_interval=settings.REVOCATION_INDEX["SYNC_INTERVAL"],
+    sync_margin=settings.REVOCATION_INDEX["SYNC_MARGIN"],
+)
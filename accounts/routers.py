@@ -0,0 +1,100 @@
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_PREFIX = "primary-pin"
+# set for the rest of the request once it touches a pinned user
+_use_primary = contextvars.ContextVar("use_primary", default=False)
+
+
+def replicas_enabled() -> bool:
+    return bool(settings.REPLICAS["ALIASES"])
+
+
+def pin_primary(*keys):
+    """
+    Sends reads about ``keys`` (e.g. ``"user:1"``, ``"email:a@b.c"``) to the
+    primary for REPLICAS["STICKY_SECONDS"], from every worker, and from now
+    on in the current request.
+    """
+    if not replicas_enabled():
+        return
+    _use_primary.set(True)
+    cache.set_many({f"{PIN_PREFIX}:{key}": True for key in keys}, settings.REPLICAS["STICKY_SECONDS"])
+
+
+def use_primary_if_pinned(*keys) -> bool:
+    """
+    Sends this request's reads to the primary if any of ``keys`` is pinned.
+    Returns whether they go there.
+    """
+    if not replicas_enabled():
+        return False
+    if _use_primary.get():
+        return True
+    if cache.get_many([f"{PIN_PREFIX}:{key}" for key in keys]):
+        _use_primary.set(True)
+        return True
+    return False
+
+
+class ReplicaRouter:
+    """
+    Writes go to the primary, reads to a random replica from
+    REPLICAS["ALIASES"]. Reads stay on the primary inside a transaction, for
+    REPLICAS["PRIMARY_MODELS"] (token state, where a lagging replica could
+    accept a revoked token) and for the rest of a request that touched a
+    pinned user, so users read their own writes.
+    """
+
+    def __init__(self):
+        self.replicas = settings.REPLICAS["ALIASES"]
+        self.primary_models = set(settings.REPLICAS["PRIMARY_MODELS"])
+
+    def db_for_read(self, model, **hints):
+        if (
+            not self.replicas
+            or _use_primary.get()
+            or model._meta.label_lower in self.primary_models
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return False if db in self.replicas else None
+
+
+@sync_and_async_middleware
+def ReplicaPinMiddleware(get_response):
+    """
+    Starts every request unpinned; context variables would otherwise carry
+    over between requests served by the same thread.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _use_primary.set(False)
+            try:
+                return await get_response(request)
+            finally:
+                _use_primary.reset(token)
+    else:
+        def middleware(request):
+            token = _use_primary.set(False)
+            try:
+                return get_response(request)
+            finally:
+                _use_primary.reset(token)
+    return middleware
@@ -0,0 +1,5 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    target_class = "accounts.authentication.CachedJWTAuthentication"
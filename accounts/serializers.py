@@ -1,5 +1,15 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from rest_framework import serializers
+from rest_framework.utils.field_mapping import get_unique_error_message
+from rest_framework_simplejwt import serializers as jwt_serializers
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
 from accounts.models import User
+from accounts.revocation import revocation_index
+from accounts.tokens import FAMILY_CLAIM, GENERATION_CLAIM, RefreshToken, afamily_is_current, family_is_current
 from phonenumber_field.serializerfields import PhoneNumberField
 from typing import Union
 
@@ -8,6 +18,32 @@ UserSerializers = Union["UserCreateSerialiser", "UserUpdateSerialiser", "UserRes
 error_messages = {"blank": "field can not be blank", "required": "field required", "invalid": "invalid"}
 
 
+class AsyncValidationMixin:
+    """
+    Adds ``ais_valid()`` for the async views: field validation runs in
+    memory as usual, then ``avalidate()`` is awaited in place of
+    ``validate()``, so serializers that query the database can use the async
+    ORM.
+    """
+
+    async def avalidate(self, attrs):
+        return attrs
+
+    async def ais_valid(self, raise_exception=False):
+        try:
+            value = self.to_internal_value(self.initial_data)
+            self.run_validators(value)
+            self._validated_data = await self.avalidate(value)
+        except (serializers.ValidationError, DjangoValidationError) as exc:
+            self._validated_data = {}
+            self._errors = serializers.as_serializer_error(exc)
+        else:
+            self._errors = {}
+        if self._errors and raise_exception:
+            raise serializers.ValidationError(self.errors)
+        return not self._errors
+
+
 class BaseUserSerializer(serializers.ModelSerializer):
     error_messages = {"blank": "field can not be blank", "required": "field required", "invalid": "invalid"}
 
@@ -46,6 +82,7 @@ class UserResponseSerializer(BaseUserSerializer):
 
 
 class UserCreateSerializer(BaseUserSerializer):
+    unique_fields = ("username", "email", "phone")
 
     class Meta(BaseUserSerializer.Meta):
         fields = (
@@ -59,21 +96,52 @@ class UserCreateSerializer(BaseUserSerializer):
         )
         extra_kwargs = {
             "password": {"write_only": True},
+            # instead of one UniqueValidator query per field, validate() checks them all at once
+            "username": {"validators": []},
+            "email": {"validators": []},
+            "phone": {"validators": []},
         }
 
-    def create(self, validated_data):
-        user = User.objects.create_user(**validated_data)
-        return user
+    def get_unique_errors(self, attrs):
+        lookups = Q()
+        for name in self.unique_fields:
+            if attrs.get(name):
+                lookups |= Q(**{name: attrs[name]})
+        if not lookups:
+            return {}
+        errors = {}
+        for row in User.objects.filter(lookups).values(*self.unique_fields):
+            for name in self.unique_fields:
+                if attrs.get(name) and row[name] == attrs[name]:
+                    errors[name] = [get_unique_error_message(User._meta.get_field(name))]
+        return errors
 
+    def validate(self, attrs):
+        errors = self.get_unique_errors(attrs)
+        if errors:
+            raise serializers.ValidationError(errors, code="unique")
+        return attrs
 
-class LoginSerializer(BaseUserSerializer):
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(**validated_data)
+        except IntegrityError:
+            # someone took the value between validate() and the INSERT
+            errors = self.get_unique_errors(validated_data)
+            if not errors:
+                raise
+            raise serializers.ValidationError(errors, code="unique")
+
+
+class LoginSerializer(AsyncValidationMixin, BaseUserSerializer):
     email = serializers.CharField(allow_blank=False, error_messages=error_messages)
 
     class Meta(BaseUserSerializer.Meta):
         fields = ("email", "password")
 
 
-class UserUpdateSerializer(BaseUserSerializer):
+class UserUpdateSerializer(AsyncValidationMixin, BaseUserSerializer):
 
     class Meta(UserResponseSerializer.Meta):
         fields = (
@@ -149,6 +217,15 @@ class ResetPasswordSerializer(AccountSerializer):
         fields = ("email",)
 
 
+class ResetPasswordConfirmSerializer(AccountSerializer):
+    uid = serializers.CharField(max_length=64, error_messages=error_messages)
+    token = serializers.CharField(max_length=64, error_messages=error_messages)
+
+    class Meta:
+        model = User
+        fields = ("uid", "token", "new_password")
+
+
 class ChangeEmailSerializer(AccountSerializer):
     class Meta:
         model = User
@@ -183,3 +260,104 @@ class ChangeUsernameConfirmSerializer(AccountSerializer):
     class Meta:
         model = User
         fields = ("username", "code",)
+
+
+class TokenRefreshSerializer(AsyncValidationMixin, jwt_serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        rotated = api_settings.ROTATE_REFRESH_TOKENS
+        if refresh.is_family:
+            if rotated:
+                refresh.rotate()
+            else:
+                refresh.check_family()
+        elif settings.TOKEN_ISSUANCE["FAMILIES"]:
+            # tokens issued before families were enabled move into a new
+            # family on their next refresh
+            refresh.blacklist()
+            self.reissue(refresh)
+            refresh.start_family(refresh[api_settings.USER_ID_CLAIM])
+            rotated = True
+        elif rotated:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            self.reissue(refresh)
+        return self.get_tokens(refresh, rotated)
+
+    async def avalidate(self, attrs):
+        refresh = await self.token_class.aload(attrs["refresh"])
+        rotated = api_settings.ROTATE_REFRESH_TOKENS
+        if refresh.is_family:
+            if rotated:
+                await refresh.arotate()
+            else:
+                await refresh.acheck_family()
+        elif settings.TOKEN_ISSUANCE["FAMILIES"]:
+            await refresh.ablacklist()
+            self.reissue(refresh)
+            await refresh.astart_family(refresh[api_settings.USER_ID_CLAIM])
+            rotated = True
+        elif rotated:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                await refresh.ablacklist()
+            self.reissue(refresh)
+        return self.get_tokens(refresh, rotated)
+
+    def reissue(self, refresh):
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+
+    def get_tokens(self, refresh, rotated) -> dict:
+        data = {"access": str(refresh.access_token)}
+        if rotated:
+            data["refresh"] = str(refresh)
+        return data
+
+
+class TokenVerifySerializer(AsyncValidationMixin, jwt_serializers.TokenVerifySerializer):
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if FAMILY_CLAIM in token and token.get(api_settings.TOKEN_TYPE_CLAIM) == RefreshToken.token_type:
+            revoked = not family_is_current(token[FAMILY_CLAIM], token.get(GENERATION_CLAIM))
+        else:
+            revoked = revocation_index.is_revoked(token.get(api_settings.JTI_CLAIM))
+        if revoked:
+            raise serializers.ValidationError("Token is blacklisted")
+        return {}
+
+    async def avalidate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if FAMILY_CLAIM in token and token.get(api_settings.TOKEN_TYPE_CLAIM) == RefreshToken.token_type:
+            revoked = not await afamily_is_current(token[FAMILY_CLAIM], token.get(GENERATION_CLAIM))
+        else:
+            revoked = await revocation_index.ais_revoked(token.get(api_settings.JTI_CLAIM))
+        if revoked:
+            raise serializers.ValidationError("Token is blacklisted")
+        return {}
+
+
+class TokenIntrospectSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(allow_blank=False),
+        allow_empty=False,
+        max_length=settings.INTROSPECTION["MAX_TOKENS"],
+        error_messages=error_messages,
+    )
+
+
+class TokenIntrospectResultSerializer(serializers.Serializer):
+    active = serializers.BooleanField()
+    token_type = serializers.CharField(required=False)
+    user_id = serializers.IntegerField(required=False, allow_null=True)
+    exp = serializers.IntegerField(required=False, allow_null=True)
+    revoked = serializers.BooleanField(required=False)
+    user_active = serializers.BooleanField(required=False)
+    error = serializers.CharField(required=False)
+
+
+class TokenBlacklistSerializer(jwt_serializers.TokenBlacklistSerializer):
+    token_class = RefreshToken
@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import user_cache
+from .models import User
+from .routers import pin_primary
+from .serializers import UserResponseSerializer
+
+# what a client sees of itself, plus the columns a login is checked against
+PINNED_FIELDS = {*UserResponseSerializer.Meta.fields, "password"}
+
+
+def user_cache_key(user: User):
+    # must match the claim written by Token.for_user
+    user_id = getattr(user, api_settings.USER_ID_FIELD)
+    if not isinstance(user_id, int):
+        user_id = str(user_id)
+    return user_id
+
+
+@receiver(post_save, sender=User, dispatch_uid="accounts_user_cache_save")
+@receiver(post_delete, sender=User, dispatch_uid="accounts_user_cache_delete")
+def invalidate_user_cache(sender, instance: User, **kwargs):
+    key = user_cache_key(instance)
+    user_cache.delete(key)
+    # a concurrent request may have re-cached the old row before the commit
+    transaction.on_commit(lambda: user_cache.delete(key), using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=User, dispatch_uid="accounts_user_pin_primary")
+def pin_user_to_primary(sender, instance: User, created=False, update_fields=None, **kwargs):
+    """
+    Read-your-writes: once the save commits, reads of this user go to the
+    primary until the replicas have caught up. Saves limited to columns the
+    client never reads back do not pin.
+    """
+    if not created and update_fields is not None and not PINNED_FIELDS.intersection(update_fields):
+        return
+    keys = (f"user:{user_cache_key(instance)}", f"email:{instance.email}")
+    transaction.on_commit(lambda: pin_primary(*keys), using=kwargs.get("using"))
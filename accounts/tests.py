@@ -1,3 +1,1549 @@
-from django.test import TestCase
+import contextvars
+import difflib
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipIf
 
-# Create your tests here.
+import jwt
+import psycopg2
+from asgiref.sync import sync_to_async
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.urls import get_resolver, reverse
+from psycopg2 import extensions as psycopg2_extensions
+from rest_framework import permissions, serializers, status
+from rest_framework.settings import api_settings
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from accounts import async_views
+from accounts.activity import last_login_buffer
+from accounts.authentication import CachedJWTAuthentication
+from accounts.buffers import WriteBehindBuffer
+from accounts.cache import TTLLRUCache, user_cache
+from accounts.codes import CODE_LENGTH, CodeLocked, VerificationCodes, verification_codes
+from accounts.export import aexport_users, export_users
+from accounts.hashing import HashingBusy, HashingExecutor
+from accounts.issuance import OutstandingTokenBuffer, outstanding_tokens
+from accounts.keys import KeyRing, KeyRingTokenBackend
+from accounts.management.commands.import_users import Command as ImportCommand
+from accounts.models import TokenFamily, User
+from accounts.notifications import Dispatcher, LocalQueue
+from accounts.reset import encode_uid, reset_tokens
+from accounts.revocation import RevocationIndex, revocation_index
+from accounts.routers import PIN_PREFIX, ReplicaRouter, pin_primary, use_primary_if_pinned
+from accounts.throttling import LocalBucketBackend, TokenBucketThrottle
+from accounts.tokens import RefreshToken
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.log import BackgroundHandler, RequestIdMiddleware, request_id
+from core.metrics import Registry
+from core.middleware import MiddlewareDispatcher
+from core.schema import CachedJSONSchemaView, SchemaCache, SchemaDocument, schema_cache
+
+PASSWORD = "Secret-pass-1"
+QUERY_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+["`]?(\w+)', re.IGNORECASE)
+USER = "SELECT accounts_user"
+
+# Queries per request, as query_shape()s, for a worker whose in-process
+# caches (user_cache, revocation_index) are empty ("cold") or were filled
+# by an earlier request ("warm"), and the tracemalloc peak in KiB of a
+# warm request. Sync views (ASYNC_VIEWS off). Peaks depend on the Python
+# build and whatever other threads allocate, so they are only checked with
+# CHECK_ALLOCATION_BUDGETS=1.
+CHECK_ALLOCATIONS = os.environ.get("CHECK_ALLOCATION_BUDGETS", "") not in ("", "0")
+BUDGETS = {
+    "signup_user": {
+        "cold": [USER, "SAVEPOINT", "INSERT accounts_user", "RELEASE", "INSERT accounts_tokenfamily"],
+        "warm": [USER, "SAVEPOINT", "INSERT accounts_user", "RELEASE", "INSERT accounts_tokenfamily"],
+        "peak_kib": 90,
+    },
+    "login": {
+        "cold": [USER, "INSERT accounts_tokenfamily"],
+        "warm": [USER, "INSERT accounts_tokenfamily"],
+        "peak_kib": 80,
+    },
+    "token_refresh": {"cold": ["UPDATE accounts_tokenfamily"], "warm": ["UPDATE accounts_tokenfamily"], "peak_kib": 50},
+    "token_verify": {"cold": ["SELECT token_blacklist_blacklistedtoken"], "warm": [], "peak_kib": 40},
+    "token_introspect": {
+        "cold": ["SELECT token_blacklist_blacklistedtoken", "SELECT accounts_tokenfamily", USER],
+        "warm": ["SELECT accounts_tokenfamily"],
+        "peak_kib": 50,
+    },
+    "logout": {"cold": [USER, "UPDATE accounts_tokenfamily"], "warm": ["UPDATE accounts_tokenfamily"], "peak_kib": 70},
+    "token_blacklist": {"cold": ["UPDATE accounts_tokenfamily"], "warm": ["UPDATE accounts_tokenfamily"], "peak_kib": 50},
+    # ChangePasswordAPIView saves every column; saving the user evicts it from user_cache
+    "password_change": {
+        "cold": [USER, "UPDATE accounts_user"],
+        "warm": [USER, "UPDATE accounts_user"],
+        "peak_kib": 70,
+    },
+    "password_reset": {"cold": [USER], "warm": [USER], "peak_kib": 60},
+    "password_reset_confirm": {
+        "cold": [USER, "UPDATE accounts_user"],
+        "warm": [USER, "UPDATE accounts_user"],
+        "peak_kib": 70,
+    },
+    "email_change": {"cold": [USER], "warm": [], "peak_kib": 70},
+    "email_change_confirm": {
+        "cold": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "warm": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "peak_kib": 80,
+    },
+    "phone_change": {"cold": [USER], "warm": [], "peak_kib": 60},
+    "phone_change_confirm": {
+        "cold": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "warm": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "peak_kib": 80,
+    },
+    "username_change": {"cold": [USER], "warm": [], "peak_kib": 60},
+    "username_change_confirm": {
+        "cold": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "warm": [USER, "SAVEPOINT", "UPDATE accounts_user", "RELEASE"],
+        "peak_kib": 80,
+    },
+    "user_me GET": {"cold": [USER], "warm": [], "peak_kib": 60},
+    "user_me PATCH": {"cold": [USER, "UPDATE accounts_user"], "warm": [USER, "UPDATE accounts_user"], "peak_kib": 80},
+    "user_me DELETE": {
+        "cold": [
+            USER, "DELETE django_admin_log", "DELETE accounts_user_groups", "DELETE accounts_user_user_permissions",
+            "DELETE accounts_tokenfamily", "UPDATE token_blacklist_outstandingtoken", "DELETE accounts_user",
+        ],
+        "warm": [
+            "DELETE django_admin_log", "DELETE accounts_user_groups", "DELETE accounts_user_user_permissions",
+            "DELETE accounts_tokenfamily", "UPDATE token_blacklist_outstandingtoken", "DELETE accounts_user",
+        ],
+        "peak_kib": 70,
+    },
+    "user_list": {"cold": [USER, USER], "warm": [USER], "peak_kib": 80},
+    "users_export": {"cold": [USER, USER], "warm": [USER], "peak_kib": 50},
+}
+
+
+def query_shape(sql: str) -> str:
+    """``SELECT accounts_user`` for a query on accounts_user; the verb alone for SAVEPOINT and the like."""
+    verb = sql.split(None, 1)[0].upper()
+    match = QUERY_TABLE.search(sql)
+    if verb in ("SELECT", "INSERT", "UPDATE", "DELETE") and match:
+        return f"{verb} {match.group(1)}"
+    return verb
+
+
+class SignupTests(APITestCase):
+    url = reverse("accounts:signup_user")
+
+    def test_signup_checks_uniqueness_in_one_query(self):
+        data = {"username": "new", "email": "new@example.com", "phone": "+996555123456", "password": "Secret-pass-1"}
+        # uniqueness SELECT, savepoint + user INSERT + release, token family INSERT
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_signup_duplicates_reported_per_field(self):
+        User.objects.create_user(username="taken", email="taken@example.com", phone="+996555123456", password="x")
+        data = {"username": "taken", "email": "taken@example.com", "phone": "+996555123456", "password": "Secret-pass-1"}
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {"username", "email", "phone"})
+        self.assertEqual(response.data["email"][0].code, "unique")
+
+
+class RevocationIndexTests(TestCase):
+
+    def blacklist(self, jti, blacklisted_at=None):
+        token = OutstandingToken.objects.create(jti=jti, token=jti, expires_at=timezone.now() + timedelta(days=1))
+        row = BlacklistedToken.objects.create(token=token)
+        if blacklisted_at is not None:
+            BlacklistedToken.objects.filter(pk=row.pk).update(blacklisted_at=blacklisted_at)
+
+    def test_sync_picks_up_rows_committed_out_of_order(self):
+        index = RevocationIndex(capacity=100, error_rate=0.01, sync_interval=0, sync_margin=30)
+        self.blacklist("first")
+        self.assertTrue(index.is_revoked("first"))
+        # a higher id, but stamped before the newest row the index has seen
+        self.blacklist("late", timezone.now() - timedelta(seconds=10))
+        self.assertTrue(index.is_revoked("late"))
+        self.assertFalse(index.is_revoked("unknown"))
+
+    def test_fresh_filter_is_not_synced_again(self):
+        index = RevocationIndex(capacity=100, error_rate=0.01, sync_interval=60, sync_margin=30)
+        index.is_revoked("a")
+        with self.assertNumQueries(0):
+            index.sync()
+            self.assertFalse(index.is_revoked("b"))
+
+    def test_sync_queries_without_the_lock(self):
+        index = RevocationIndex(capacity=100, error_rate=0.01, sync_interval=0, sync_margin=30)
+        index.is_revoked("a")
+        self.blacklist("b")
+        scan = index._scan
+        during = []
+
+        def observed_scan(add, watermark):
+            # checks and adds are not blocked, and other threads do not sync again
+            during.append(index._lock.locked())
+            index.add("added-meanwhile")
+            index.sync()
+            return scan(add, watermark)
+
+        with mock.patch.object(index, "_scan", side_effect=observed_scan) as patched:
+            index.sync()
+        self.assertEqual((during, patched.call_count), ([False], 1))
+        self.assertTrue(index.might_contain("b"))
+        self.assertTrue(index.might_contain("added-meanwhile"))
+
+
+class OutstandingTokenBufferTests(TestCase):
+
+    def test_flush_fills_in_the_user_of_a_row_blacklisted_elsewhere(self):
+        user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        buffer = OutstandingTokenBuffer(batch_size=100, flush_interval=0)
+        refresh = RefreshToken.for_user(user)
+        jti = refresh["jti"]
+        buffer.add(jti, OutstandingToken(
+            user=user, jti=jti, token=str(refresh), created_at=timezone.now(), expires_at=timezone.now(),
+        ))
+        # what simplejwt's blacklist() creates on a worker without the buffered row
+        OutstandingToken.objects.create(jti=jti, token=str(refresh), expires_at=timezone.now())
+        buffer.flush()
+        self.assertEqual(OutstandingToken.objects.get(jti=jti).user, user)
+
+
+class WriteBehindBufferTests(TestCase):
+
+    class FlakyBuffer(WriteBehindBuffer):
+        fail = True
+
+        def merge(self, old, new):
+            return max(old, new)
+
+        def write(self, items):
+            if self.fail:
+                raise DatabaseError("database table is locked")
+            self.written = items
+
+    def test_failed_write_keeps_the_batch(self):
+        buffer = self.FlakyBuffer(batch_size=100, flush_interval=0)
+        buffer.add("a", 1)
+        with self.assertRaises(DatabaseError):
+            buffer.flush()
+        buffer.add("a", 2)
+        buffer.add("b", 1)
+        buffer.fail = False
+        buffer.flush()
+        self.assertEqual(buffer.written, {"a": 2, "b": 1})
+
+    def test_full_batch_is_written_by_the_flusher(self):
+        buffer = self.FlakyBuffer(batch_size=2, flush_interval=0)
+        buffer.fail = False
+        caller = threading.get_ident()
+        write = buffer.write
+        threads = []
+        done = threading.Event()
+
+        def record(items):
+            threads.append(threading.get_ident())
+            write(items)
+            done.set()
+
+        buffer.write = record
+        buffer.add("a", 1)
+        buffer.add("b", 1)
+        self.assertTrue(done.wait(5))
+        self.assertNotIn(caller, threads)
+        self.assertEqual(buffer.written, {"a": 1, "b": 1})
+
+
+class HashingExecutorTests(SimpleTestCase):
+
+    def test_timed_out_job_keeps_its_slot_until_it_ends(self):
+        executor = HashingExecutor(workers=1, max_pending=1, timeout=0.05)
+        executor._executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor._executor.shutdown)
+        release = threading.Event()
+        with self.assertRaises(HashingBusy):
+            executor.run("check_password", release.wait)
+        # the timed-out job still runs, so nothing more is admitted
+        with self.assertRaises(HashingBusy):
+            executor.run("check_password", release.wait)
+        self.assertEqual(executor.stats()["check_password"]["rejected"], 1)
+        release.set()
+        executor._executor.submit(lambda: None).result()
+        self.assertTrue(executor.run("check_password", release.wait))
+
+    async def test_async_timeout_is_busy(self):
+        executor = HashingExecutor(workers=1, max_pending=1, timeout=0.05)
+        executor._executor = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        self.addCleanup(executor._executor.shutdown)
+        self.addCleanup(release.set)
+        with self.assertRaises(HashingBusy):
+            await executor.arun("check_password", release.wait)
+
+
+class ImportUsersTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as file:
+            file.writelines(json.dumps(row) + "\n" for row in rows)
+        return path
+
+    def test_rejected_rows_go_to_the_reject_file(self):
+        User.objects.create_user(username="taken", email="taken@example.com", password=PASSWORD)
+        password = make_password(PASSWORD)
+        path = self.write("users.jsonl", [
+            {"username": "new", "email": "new@example.com", "password": password},
+            {"username": "other", "email": "taken@example.com", "password": password},
+            {"username": "plain", "email": "plain@example.com", "password": PASSWORD},
+        ])
+        rejects = os.path.join(self.directory.name, "rejects.jsonl")
+        call_command("import_users", path, "--hashed", "--reject-file", rejects, stdout=io.StringIO())
+        self.assertTrue(User.objects.filter(username="new").exists())
+        with open(rejects) as file:
+            rejected = [json.loads(line) for line in file]
+        self.assertEqual(sorted((entry["row"], list(entry["errors"])) for entry in rejected), [(1, ["email"]), (2, ["password"])])
+
+    def test_password_length_is_checked(self):
+        command = ImportCommand()
+        command.hashed = False
+        with self.assertRaises(serializers.ValidationError) as raised:
+            command.validate({"username": "new", "email": "new@example.com", "password": "short"})
+        self.assertEqual(list(raised.exception.detail), ["password"])
+
+
+class UserExportTests(APITestCase):
+    url = reverse("accounts:users_export")
+
+    def setUp(self):
+        admin = User.objects.create_superuser("admin", PASSWORD)
+        self.client.force_authenticate(admin)
+        self.access = str(RefreshToken.for_user(admin).access_token)
+
+    def test_gzip_only_when_accepted(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b'"username": "admin"', gzip.decompress(b"".join(response.streaming_content)))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip;q=0, identity")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn(b'"username": "admin"', b"".join(response.streaming_content))
+
+    async def test_asgi_response_streams_asynchronously(self):
+        response = await self.async_client.get(self.url, headers={"Authorization": f"Bearer {self.access}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+
+    async def test_async_export_matches_sync(self):
+        chunks = [chunk async for chunk in aexport_users("csv")]
+        expected = await sync_to_async(lambda: list(export_users("csv")))()
+        self.assertEqual(chunks, expected)
+
+
+class UserListTests(APITestCase):
+    url = reverse("accounts:user_list")
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", PASSWORD)
+        self.client.force_authenticate(self.admin)
+        joined = timezone.now() - timedelta(days=1)
+        for number in range(5):
+            User.objects.create_user(username=f"user{number}", email=f"user{number}@example.com", password=PASSWORD)
+        # ties on date_joined are broken by id
+        User.objects.filter(username__in=["user1", "user2", "user3"]).update(date_joined=joined)
+
+    def test_cursor_pages_cover_every_user_once(self):
+        expected = list(User.objects.order_by("-date_joined", "-id").values_list("username", flat=True))
+        seen = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(user["username"] for user in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TokenBucketTests(APITestCase):
+
+    def test_bucket_denies_when_empty_and_refills(self):
+        now = [0.0]
+        backend = LocalBucketBackend(clock=lambda: now[0])
+        self.assertTrue(backend.take("login:1", 2, 1.0)[0])
+        self.assertTrue(backend.take("login:1", 2, 1.0)[0])
+        self.assertFalse(backend.take("login:1", 2, 1.0)[0])
+        now[0] += 1.0
+        self.assertTrue(backend.take("login:1", 2, 1.0)[0])
+        self.assertFalse(backend.take("login:1", 2, 1.0)[0])
+
+    def test_login_is_throttled(self):
+        rates = {**api_settings.DEFAULT_THROTTLE_RATES, "login": "2/min"}
+        data = {"email": "nobody@example.com", "password": PASSWORD}
+        with mock.patch.object(TokenBucketThrottle, "backend", LocalBucketBackend()), \
+                override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": rates}):
+            statuses = [self.client.post(reverse("accounts:login"), data).status_code for _ in range(3)]
+            response = self.client.post(reverse("accounts:login"), data)
+        self.assertNotIn(status.HTTP_429_TOO_MANY_REQUESTS, statuses[:2])
+        self.assertEqual(statuses[2], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+
+
+class VerificationCodeTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        self.codes = VerificationCodes(ttl=60, max_attempts=3, lockout=60)
+
+    def wrong(self, code):
+        return str((int(code) + 1) % 10 ** CODE_LENGTH).zfill(CODE_LENGTH)
+
+    def test_correct_code_confirms_once(self):
+        code = self.codes.issue(self.user.pk, "email", "new@example.com")
+        self.assertFalse(self.codes.check(self.user.pk, "email", "other@example.com", code))
+        self.assertTrue(self.codes.check(self.user.pk, "email", "new@example.com", code))
+        self.assertFalse(self.codes.check(self.user.pk, "email", "new@example.com", code))
+
+    def test_reissue_does_not_reset_attempts(self):
+        for _ in range(2):
+            code = self.codes.issue(self.user.pk, "email", "new@example.com")
+            self.assertFalse(self.codes.check(self.user.pk, "email", "new@example.com", self.wrong(code)))
+        code = self.codes.issue(self.user.pk, "email", "new@example.com")
+        with self.assertRaises(CodeLocked):
+            self.codes.check(self.user.pk, "email", "new@example.com", self.wrong(code))
+        code = self.codes.issue(self.user.pk, "email", "new@example.com")
+        with self.assertRaises(CodeLocked):
+            self.codes.check(self.user.pk, "email", "new@example.com", code)
+        # other purposes are not affected
+        code = self.codes.issue(self.user.pk, "phone", "+996555123456")
+        self.assertTrue(self.codes.check(self.user.pk, "phone", "+996555123456", code))
+
+    def test_confirm_endpoint_locks_out(self):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        data = {"new_email": "new@example.com"}
+        code = verification_codes.issue(self.user.pk, "email", data["new_email"])
+        data["code"] = self.wrong(code)
+        statuses = [
+            self.client.post(reverse("accounts:email_change_confirm"), data, **headers).status_code
+            for _ in range(verification_codes.max_attempts)
+        ]
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(set(statuses[:-1]), {status.HTTP_400_BAD_REQUEST})
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, "alice@example.com")
+
+    def test_taken_value_is_rejected_on_confirm(self):
+        User.objects.create_user(username="bob", email="bob@example.com", password=PASSWORD)
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        data = {"new_email": "bob@example.com"}
+        data["code"] = verification_codes.issue(self.user.pk, "email", data["new_email"])
+        response = self.client.post(reverse("accounts:email_change_confirm"), data, **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("new_email", response.data)
+
+
+class DispatcherTests(SimpleTestCase):
+
+    class RecordingBackend:
+        sent = []
+
+        def __init__(self, fail=0):
+            self.fail = fail
+
+        def send_messages(self, messages):
+            if self.fail:
+                self.fail -= 1
+                raise ConnectionError("smtp down")
+            self.sent.extend(messages)
+            return []
+
+    class BrokenQueue(LocalQueue):
+        def __init__(self, failures):
+            super().__init__()
+            self.failures = failures
+
+        def get_batch(self, size, timeout):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("queue unreachable")
+            return super().get_batch(size, timeout)
+
+    def make_dispatcher(self, queue=None, fail=0):
+        self.RecordingBackend.sent = []
+        backends = {"email": {"BACKEND": "accounts.notifications.ConsoleBackend"}}
+        dispatcher = Dispatcher(queue if queue is not None else LocalQueue(), backends, batch_size=10, max_retries=2, backoff=0.01)
+        dispatcher._backends["email"] = self.RecordingBackend(fail)
+        return dispatcher
+
+    def test_failed_batch_is_retried_then_dead_lettered(self):
+        dispatcher = self.make_dispatcher(fail=1)
+        dispatcher.enqueue("email", "a@example.com", "Hi", "body")
+        dispatcher.process_batch(dispatcher.queue.get_batch(10, 1))
+        dispatcher.process_batch(dispatcher.queue.get_batch(10, 1))
+        self.assertEqual([m["to"] for m in self.RecordingBackend.sent], ["a@example.com"])
+        self.assertEqual(dispatcher.stats()["retried"], 1)
+
+        dispatcher = self.make_dispatcher(fail=3)
+        dispatcher.enqueue("email", "b@example.com", "Hi", "body")
+        for _ in range(3):
+            dispatcher.process_batch(dispatcher.queue.get_batch(10, 1))
+        self.assertEqual(dispatcher.stats()["dead_lettered"], 1)
+        self.assertEqual(len(dispatcher.queue.dead_letters), 1)
+
+    def test_worker_survives_queue_errors(self):
+        dispatcher = self.make_dispatcher(self.BrokenQueue(failures=2))
+        dispatcher.enqueue("email", "a@example.com", "Hi", "body")
+        with self.assertLogs("accounts.notifications", "ERROR"):
+            dispatcher.start(1)
+            try:
+                for _ in range(100):
+                    if self.RecordingBackend.sent:
+                        break
+                    time.sleep(0.02)
+            finally:
+                dispatcher.stop()
+        self.assertEqual(len(self.RecordingBackend.sent), 1)
+
+    def test_channel_without_backend_is_refused(self):
+        dispatcher = Dispatcher(LocalQueue(), {"sms": {"BACKEND": ""}}, batch_size=10, max_retries=2, backoff=0.01)
+        with self.assertRaises(ImproperlyConfigured):
+            dispatcher.enqueue("sms", "+996555123456", "Code", "1234")
+
+
+class PasswordResetTests(APITestCase):
+
+    def setUp(self):
+        # fresh buckets, the reset endpoints allow only a few requests an hour
+        throttle = mock.patch.object(TokenBucketThrottle, "backend", LocalBucketBackend())
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+
+    def confirm(self, token, new_password="New-secret-pass-2", user=None):
+        data = {"uid": encode_uid(user or self.user), "token": token, "new_password": new_password}
+        return self.client.post(reverse("accounts:password_reset_confirm"), data)
+
+    def test_link_is_sent_only_to_registered_email(self):
+        with mock.patch("accounts.reset.notify") as notify:
+            for email in ("alice@example.com", "nobody@example.com"):
+                response = self.client.post(reverse("accounts:password_reset"), {"email": email})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args.args[1], "alice@example.com")
+        self.assertIn(encode_uid(self.user), notify.call_args.args[3])
+
+    def test_token_resets_password_once(self):
+        token = reset_tokens.make_token(self.user)
+        self.assertEqual(self.confirm(token).status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password("New-secret-pass-2"))
+        response = self.confirm(token, "Other-secret-pass-3")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("token", response.data)
+
+    def test_password_change_invalidates_token(self):
+        token = reset_tokens.make_token(self.user)
+        self.user.set_password("Changed-pass-4")
+        self.user.save(update_fields=["password"])
+        self.assertEqual(self.confirm(token).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password("Changed-pass-4"))
+
+    def test_token_expires(self):
+        token = reset_tokens.make_token(self.user)
+        later = reset_tokens._now() + timedelta(seconds=settings.PASSWORD_RESET_TIMEOUT + 1)
+        with mock.patch.object(type(reset_tokens), "_now", return_value=later):
+            self.assertEqual(self.confirm(token).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.confirm(token).status_code, status.HTTP_200_OK)
+
+    def test_token_is_bound_to_user(self):
+        other = User.objects.create_user(username="bob", email="bob@example.com", password=PASSWORD)
+        token = reset_tokens.make_token(self.user)
+        self.assertEqual(self.confirm(token, user=other).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("accounts:password_reset_confirm"),
+                                    {"uid": "not-a-uid", "token": token, "new_password": "New-secret-pass-2"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class KeyRingTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.paths = []
+        for name in ("old", "new"):
+            key = ec.generate_private_key(ec.SECP256R1())
+            path = os.path.join(cls.directory.name, f"{name}.pem")
+            with open(path, "wb") as key_file:
+                key_file.write(key.private_bytes(
+                    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+                ))
+            cls.paths.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def backend(self, paths):
+        return KeyRingTokenBackend(KeyRing("ES256", paths))
+
+    def test_rotated_key_still_verifies(self):
+        old_path, new_path = self.paths
+        before = self.backend([old_path])
+        after = self.backend([new_path, old_path])
+        token = before.encode({"user_id": 1})
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], before.key_ring.current_kid)
+        self.assertNotEqual(after.key_ring.current_kid, before.key_ring.current_kid)
+        self.assertEqual(after.decode(token)["user_id"], 1)
+        new_token = after.encode({"user_id": 2})
+        self.assertEqual(jwt.get_unverified_header(new_token)["kid"], after.key_ring.current_kid)
+        # a key that has been dropped from the ring no longer verifies
+        with self.assertRaises(TokenBackendError):
+            self.backend([new_path]).decode(token)
+        with self.assertRaises(TokenBackendError):
+            before.decode(new_token)
+
+    def test_kid_depends_only_on_the_key(self):
+        old = KeyRing("ES256", self.paths[:1])
+        rotated = KeyRing("ES256", self.paths[::-1])
+        self.assertEqual(list(rotated.public_keys)[1], old.current_kid)
+        self.assertNotEqual(rotated.etag, old.etag)
+
+    def test_symmetric_algorithm_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            KeyRing("HS256", self.paths)
+
+    def test_jwks_lists_every_key(self):
+        ring = KeyRing("ES256", self.paths[::-1])
+        with mock.patch("accounts.views.key_ring", ring):
+            response = self.client.get(reverse("jwks"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            keys = json.loads(response.content)["keys"]
+            self.assertEqual([key["kid"] for key in keys], list(ring.public_keys))
+            self.assertEqual({(key["alg"], key["use"]) for key in keys}, {("ES256", "sig")})
+            self.assertNotIn("d", keys[0])
+            self.assertEqual(response["ETag"], ring.etag)
+            response = self.client.get(reverse("jwks"), HTTP_IF_NONE_MATCH=ring.etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertIn("max-age", response["Cache-Control"])
+        with mock.patch("accounts.views.key_ring", None):
+            self.assertEqual(self.client.get(reverse("jwks")).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(INTROSPECTION={**settings.INTROSPECTION, "TOKEN": "gateway-secret"})
+class TokenIntrospectTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        self.gateway = {"HTTP_X_GATEWAY_TOKEN": "gateway-secret"}
+
+    def introspect(self, tokens, **headers):
+        return self.client.post(reverse("accounts:token_introspect"), {"tokens": tokens}, format="json", **headers)
+
+    def test_requires_staff_or_gateway_token(self):
+        access = str(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(self.introspect([access]).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.introspect([access], HTTP_X_GATEWAY_TOKEN="wrong").status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.introspect([access], HTTP_AUTHORIZATION=f"Bearer {access}").status_code,
+                         status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_superuser("admin", PASSWORD)
+        admin_access = RefreshToken.for_user(admin).access_token
+        self.assertEqual(self.introspect([access], HTTP_AUTHORIZATION=f"Bearer {admin_access}").status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(self.introspect([access], **self.gateway).status_code, status.HTTP_200_OK)
+        with override_settings(INTROSPECTION={**settings.INTROSPECTION, "TOKEN": ""}):
+            self.assertEqual(self.introspect([access], HTTP_X_GATEWAY_TOKEN="").status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+
+    def test_results_keep_order_and_state(self):
+        bob = User.objects.create_user(username="bob", email="bob@example.com", password=PASSWORD)
+        access = str(RefreshToken.for_user(self.user).access_token)
+        refresh = RefreshToken.for_user(self.user)
+        revoked = RefreshToken.for_user(self.user)
+        rotated = RefreshToken.for_user(self.user)
+        revoked.blacklist()
+        self.client.post(reverse("accounts:token_refresh"), {"refresh": str(rotated)})
+        bob_access = str(RefreshToken.for_user(bob).access_token)
+        User.objects.filter(pk=bob.pk).update(is_active=False)
+        user_cache.clear()
+
+        tokens = [access, "garbage", str(refresh), str(revoked), str(rotated), bob_access]
+        response = self.introspect(tokens, **self.gateway)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([result["active"] for result in results], [True, False, True, False, False, False])
+        self.assertIn("error", results[1])
+        self.assertEqual(results[0]["token_type"], "access")
+        self.assertEqual(results[0]["user_id"], self.user.pk)
+        self.assertEqual([results[i]["revoked"] for i in (2, 3, 4, 5)], [False, True, True, False])
+        self.assertFalse(results[5]["user_active"])
+
+
+class TokenFamilyTests(APITestCase):
+
+    def setUp(self):
+        throttle = mock.patch.object(TokenBucketThrottle, "backend", LocalBucketBackend())
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+
+    def refresh(self, token):
+        return self.client.post(reverse("accounts:token_refresh"), {"refresh": str(token)})
+
+    def test_replayed_generation_revokes_family(self):
+        first = RefreshToken.for_user(self.user)
+        response = self.refresh(first)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        second = response.data["refresh"]
+        self.assertEqual(RefreshToken(second)["gen"], first["gen"] + 1)
+        self.assertEqual(self.refresh(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        family = TokenFamily.objects.get(pk=first["fam"])
+        self.assertIsNotNone(family.revoked_at)
+        # the thief's replay also locks out the current holder
+        self.assertEqual(self.refresh(second).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_legacy_token_moves_into_family(self):
+        self.addCleanup(outstanding_tokens._pending.clear)
+        with override_settings(TOKEN_ISSUANCE={**settings.TOKEN_ISSUANCE, "FAMILIES": False}), \
+                mock.patch.object(WriteBehindBuffer, "_ensure_flusher"):
+            legacy = RefreshToken.for_user(self.user)
+        self.assertNotIn("fam", legacy.payload)
+        with mock.patch.object(WriteBehindBuffer, "_ensure_flusher"):
+            response = self.refresh(legacy)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        migrated = RefreshToken(response.data["refresh"])
+        self.assertTrue(TokenFamily.objects.filter(pk=migrated["fam"], user=self.user, revoked_at=None).exists())
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=legacy["jti"]).exists())
+        self.assertEqual(self.refresh(legacy).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(migrated).status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_family(self):
+        refresh = RefreshToken(self.refresh(RefreshToken.for_user(self.user)).data["refresh"])
+        response = self.client.post(reverse("accounts:logout"), {"refresh": str(refresh)},
+                                    HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+        self.assertIsNotNone(TokenFamily.objects.get(pk=refresh["fam"]).revoked_at)
+        self.assertEqual(self.refresh(refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_flush_deletes_only_expired_and_revoked(self):
+        now = timezone.now()
+        live = TokenFamily.objects.create(user=self.user, expires_at=now + timedelta(days=1))
+        TokenFamily.objects.create(user=self.user, expires_at=now - timedelta(seconds=1))
+        TokenFamily.objects.create(user=self.user, expires_at=now + timedelta(days=1), revoked_at=now)
+        out = io.StringIO()
+        call_command("flushtokenfamilies", stdout=out)
+        self.assertEqual(list(TokenFamily.objects.all()), [live])
+        self.assertIn("Deleted 2 token families", out.getvalue())
+
+
+class AsyncViewTests(APITestCase):
+
+    class RecordingBuffer(WriteBehindBuffer):
+        def __init__(self):
+            super().__init__(batch_size=2, flush_interval=0)
+            self.written = []
+            self.done = threading.Event()
+
+        def write(self, items):
+            self.written.append((threading.current_thread().name, dict(items)))
+            self.done.set()
+
+    def setUp(self):
+        throttle = mock.patch.object(TokenBucketThrottle, "backend", LocalBucketBackend())
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        self.factory = AsyncRequestFactory()
+
+    async def post(self, view, data, **headers):
+        request = self.factory.post("/", data, content_type="application/json", **headers)
+        return await view.as_view()(request)
+
+    async def test_login_is_throttled(self):
+        data = {"email": "alice@example.com", "password": PASSWORD}
+        rates = {**api_settings.DEFAULT_THROTTLE_RATES, "login": "2/min"}
+        with mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, rates):
+            statuses = [(await self.post(async_views.LoginView, data)).status_code for _ in range(3)]
+        self.assertEqual(statuses, [status.HTTP_200_OK, status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS])
+
+    async def test_profile_requires_authentication(self):
+        view = async_views.ProfileView.as_view()
+        response = await view(self.factory.get("/"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response["WWW-Authenticate"], async_views.BEARER_CHALLENGE)
+        access = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        response = await view(self.factory.get("/", headers={"Authorization": f"Bearer {access}"}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_permission_classes_apply(self):
+        class AdminOnlyLogin(async_views.LoginView):
+            permission_classes = [permissions.IsAdminUser]
+
+        response = await self.post(AdminOnlyLogin, {"email": "alice@example.com", "password": PASSWORD})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_refresh_rotates_and_rejects_replay(self):
+        first = await sync_to_async(RefreshToken.for_user)(self.user)
+        response = await self.post(async_views.TokenRefreshView, {"refresh": str(first)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        second = RefreshToken(response.data["refresh"])
+        self.assertEqual((second["fam"], second["gen"]), (first["fam"], first["gen"] + 1))
+        response = await self.post(async_views.TokenRefreshView, {"refresh": str(first)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.post(async_views.TokenRefreshView, {"refresh": str(second)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_refresh_moves_legacy_token_into_family(self):
+        self.addCleanup(outstanding_tokens._pending.clear)
+        with override_settings(TOKEN_ISSUANCE={**settings.TOKEN_ISSUANCE, "FAMILIES": False}), \
+                mock.patch.object(WriteBehindBuffer, "_ensure_flusher"):
+            legacy = await sync_to_async(RefreshToken.for_user)(self.user)
+        with mock.patch.object(WriteBehindBuffer, "_ensure_flusher"):
+            response = await self.post(async_views.TokenRefreshView, {"refresh": str(legacy)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("fam", RefreshToken(response.data["refresh"]).payload)
+        response = await self.post(async_views.TokenRefreshView, {"refresh": str(legacy)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_verify(self):
+        refresh = await sync_to_async(RefreshToken.for_user)(self.user)
+        for token in (refresh.access_token, refresh):
+            response = await self.post(async_views.TokenVerifyView, {"token": str(token)})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.post(async_views.TokenVerifyView, {"token": "garbage"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        await refresh.ablacklist()
+        response = await self.post(async_views.TokenVerifyView, {"token": str(refresh)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_full_batch_is_written_off_the_event_loop(self):
+        buffer = self.RecordingBuffer()
+        loop_thread = threading.current_thread().name
+        buffer.add(1, "a")
+        buffer.add(2, "b")
+        # add() only wakes the flusher, it never writes itself
+        self.assertEqual(buffer.written, [])
+        self.assertTrue(await sync_to_async(buffer.done.wait, thread_sensitive=False)(5))
+        self.assertEqual(buffer.written, [("write-behind-flusher", {1: "a", 2: "b"})])
+        self.assertNotEqual(loop_thread, "write-behind-flusher")
+
+    async def test_login_fills_batches_without_writing(self):
+        data = {"email": "alice@example.com", "password": PASSWORD}
+        issuance = {**settings.TOKEN_ISSUANCE, "FAMILIES": False}
+        buffers = (last_login_buffer, outstanding_tokens)
+        self.addCleanup(lambda: [(buffer._pending.clear(), buffer._wake.clear()) for buffer in buffers])
+        # keep the flusher threads out of the test database
+        with override_settings(TOKEN_ISSUANCE=issuance), \
+                mock.patch.object(WriteBehindBuffer, "_ensure_flusher"), \
+                mock.patch.object(last_login_buffer, "batch_size", 1), \
+                mock.patch.object(outstanding_tokens, "batch_size", 1):
+            response = await self.post(async_views.LoginView, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for buffer in buffers:
+            self.assertEqual(len(buffer), 1)
+            self.assertTrue(buffer._wake.is_set())
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    class StubConnection:
+        def __init__(self):
+            self.closed = 0
+            self.broken = False
+            self.status = psycopg2_extensions.TRANSACTION_STATUS_IDLE
+            self.rollbacks = 0
+
+        def cursor(self):
+            connection = self
+
+            class Cursor:
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    return False
+
+                def execute(self, sql):
+                    if connection.broken:
+                        raise psycopg2.OperationalError("server closed the connection")
+
+            return Cursor()
+
+        def get_transaction_status(self):
+            return self.status
+
+        def rollback(self):
+            self.rollbacks += 1
+            self.status = psycopg2_extensions.TRANSACTION_STATUS_IDLE
+
+        def close(self):
+            self.closed = 1
+
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch("core.db.pool.time.monotonic", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def make_pool(self, **options):
+        options = {"min_size": 0, "max_size": 3, "timeout": 1.0, "max_lifetime": 3600.0, "max_idle": 600.0,
+                   "check_after": 30.0, **options}
+        return ConnectionPool(self.StubConnection, **options)
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+        stats = pool.stats()
+        self.assertEqual((stats["created"], stats["checkouts"], stats["in_use"]), (1, 2, 1))
+
+    def test_open_transaction_is_rolled_back_on_return(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        connection.status = psycopg2_extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertIs(pool.getconn(), connection)
+
+    def test_old_connection_is_closed_on_return(self):
+        pool = self.make_pool(max_lifetime=60.0)
+        connection = pool.getconn()
+        self.now += 61
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+        self.assertIsNot(pool.getconn(), connection)
+
+    def test_idle_connections_above_min_size_are_evicted(self):
+        pool = self.make_pool(max_idle=600.0)
+        # set after construction so no background fill runs
+        pool.min_size = 1
+        connections = [pool.getconn() for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+        self.now += 601
+        reused = pool.getconn()
+        # the two oldest are closed, the most recently returned one is kept
+        self.assertEqual([connection.closed for connection in connections], [1, 1, 0])
+        self.assertIs(reused, connections[2])
+        self.assertEqual(pool.stats()["closed"], 2)
+
+    def test_stale_connection_is_pinged_and_replaced(self):
+        pool = self.make_pool(check_after=30.0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.broken = True
+        self.now += 10
+        self.assertIs(pool.getconn(), connection)
+        pool.putconn(connection)
+        self.now += 31
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()["health_check_failures"], 1)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_waiting_checkout_gets_returned_connection(self):
+        pool = self.make_pool(max_size=1, timeout=5.0)
+        connection = pool.getconn()
+        timer = threading.Timer(0.05, pool.putconn, [connection])
+        timer.start()
+        self.assertIs(pool.getconn(), connection)
+        timer.join()
+        self.assertEqual(pool.stats()["waits"], 1)
+
+
+@override_settings(REPLICAS={**settings.REPLICAS, "ALIASES": ["replica_1"]})
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+
+    def read(self, model=User):
+        # outside TestCase's transaction, where every read stays on the primary
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            return self.router.db_for_read(model)
+
+    def in_request(self, function):
+        # each request starts unpinned, as with ReplicaPinMiddleware
+        return contextvars.copy_context().run(function)
+
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        self.assertEqual(self.in_request(self.read), "replica_1")
+        self.assertEqual(self.in_request(lambda: self.read(BlacklistedToken)), "default")
+        self.assertEqual(self.router.db_for_write(User), "default")
+        # inside a transaction reads see its writes
+        self.assertEqual(self.in_request(lambda: self.router.db_for_read(User)), "default")
+        with override_settings(REPLICAS={**settings.REPLICAS, "ALIASES": []}):
+            self.router = ReplicaRouter()
+            self.assertEqual(self.in_request(self.read), "default")
+
+    def test_pinned_user_is_read_from_primary(self):
+        def pinned_request():
+            pin_primary("user:1")
+            return self.read()
+
+        def later_request(key):
+            use_primary_if_pinned(key)
+            return self.read()
+
+        self.assertEqual(self.in_request(pinned_request), "default")
+        self.assertEqual(self.in_request(lambda: later_request("user:1")), "default")
+        self.assertEqual(self.in_request(lambda: later_request("user:2")), "replica_1")
+
+    def test_pinned_user_skips_the_user_cache(self):
+        user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        authentication = CachedJWTAuthentication()
+        # another worker saved the user; this worker's cache never saw the eviction
+        user_cache.set(user.pk, user)
+        self.addCleanup(user_cache.clear)
+        self.assertIsNotNone(self.in_request(lambda: authentication.get_cached_user(user.pk)))
+
+        def pinned_lookup():
+            return authentication.get_cached_user(user.pk), self.read()
+
+        cache.set(f"{PIN_PREFIX}:user:{user.pk}", True)
+        self.assertEqual(self.in_request(pinned_lookup), (None, "default"))
+
+    def test_save_pins_after_commit(self):
+        user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        cache.clear()
+
+        def save():
+            with self.captureOnCommitCallbacks(execute=True):
+                user.first_name = "Alice"
+                user.save(update_fields=["first_name"])
+                self.assertIsNone(cache.get(f"{PIN_PREFIX}:user:{user.pk}"))
+            return self.read()
+
+        self.assertEqual(self.in_request(save), "default")
+        self.assertTrue(cache.get(f"{PIN_PREFIX}:user:{user.pk}"))
+        self.assertTrue(cache.get(f"{PIN_PREFIX}:email:alice@example.com"))
+
+    def test_saves_nobody_reads_back_do_not_pin(self):
+        user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        cache.clear()
+
+        def save():
+            with self.captureOnCommitCallbacks(execute=True):
+                user.save(update_fields=["_uuid"])
+            return self.read()
+
+        self.assertEqual(self.in_request(save), "replica_1")
+        self.assertIsNone(cache.get(f"{PIN_PREFIX}:user:{user.pk}"))
+
+
+class SchemaCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_variants_follow_accept_encoding(self):
+        document = SchemaDocument(b'{"openapi": "3.0.3"}' * 50)
+        identity = document.variant("")
+        self.assertEqual(identity[0], "identity")
+        encoding, body, etag = document.variant("gzip, deflate")
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(gzip.decompress(body), identity[1])
+        self.assertNotEqual(etag, identity[2])
+        self.assertEqual(document.variant("gzip;q=0")[0], "identity")
+        # same body, same tags
+        self.assertEqual(SchemaDocument(identity[1]).variants["identity"][1], identity[2])
+
+    def test_rendered_schema_is_shared_through_the_directory(self):
+        renderer = CachedJSONSchemaView.renderer_classes[0]()
+        first = SchemaCache(self.directory)
+        with mock.patch.object(SchemaCache, "render", return_value=b'{"paths": {}}') as render:
+            first.get("v1", renderer)
+            first.get("v1", renderer)
+            self.assertEqual(render.call_count, 1)
+            second = SchemaCache(self.directory)
+            document = second.get("v1", renderer)
+            self.assertEqual(render.call_count, 1)
+        self.assertEqual(document.variants["identity"][0], b'{"paths": {}}')
+        self.assertEqual(second.version, first.version)
+
+    def test_unknown_languages_share_the_default_schema(self):
+        cache = SchemaCache(self.directory)
+        with mock.patch("core.schema.schema_cache", cache), \
+                mock.patch.object(SchemaCache, "render", return_value=b'{"paths": {}}') as render:
+            for lang in ("a1", "a2", "en", "ru-ru"):
+                response = self.client.get(reverse("schema_json"), {"lang": lang})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(sorted(lang for _, lang, _ in cache.documents), ["en", "ru"])
+        self.assertEqual(sorted(path.name for path in (Path(self.directory) / cache.version).iterdir()),
+                         ["v1.en.json", "v1.ru.json"])
+
+    def test_conditional_requests(self):
+        url = reverse("schema_json")
+        with mock.patch.object(schema_cache, "directory", None), mock.patch.object(schema_cache, "documents", {}):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn("/api/v1/auth/login/", json.loads(response.content)["paths"])
+            etag = response["ETag"]
+            self.assertIn("no-cache", response["Cache-Control"])
+            self.assertIn("Accept-Encoding", response["Vary"])
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, b"")
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertNotEqual(response["ETag"], etag)
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class MiddlewareDispatcherTests(SimpleTestCase):
+    frame_options = "django.middleware.clickjacking.XFrameOptionsMiddleware"
+
+    def dispatch(self, path):
+        return MiddlewareDispatcher(lambda request: None)(RequestFactory().get(path))
+
+    @override_settings(MIDDLEWARE_ROUTES={"/a/": [], "/a/b/": [frame_options], "/": [frame_options]})
+    def test_longest_prefix_wins(self):
+        self.assertNotIn("X-Frame-Options", self.dispatch("/a/x"))
+        self.assertEqual(self.dispatch("/a/b/x")["X-Frame-Options"], "DENY")
+        self.assertEqual(self.dispatch("/other")["X-Frame-Options"], "DENY")
+
+    @override_settings(MIDDLEWARE_ROUTES={"/a/": []})
+    def test_unrouted_path_is_an_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.dispatch("/b/")
+
+    def test_api_skips_browser_middleware(self):
+        if settings.MIDDLEWARE != ["core.middleware.MiddlewareDispatcher"]:
+            self.skipTest("LEAN_MIDDLEWARE is off")
+        response = self.client.get(reverse("jwks"))
+        self.assertNotIn("X-Frame-Options", response)
+        self.assertIn("X-Request-ID", response)
+        response = self.client.get(reverse("admin:login"))
+        self.assertEqual(response["X-Frame-Options"], "DENY")
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class RequestLoggingTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "app.log")
+        self.handler = BackgroundHandler(console=False, filename=self.path)
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger("accounts.tests.request_logging")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def records(self):
+        self.handler.stop()
+        with open(self.path) as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def view(self, request):
+        self.logger.info("handled %s", request.path, extra={"user_id": 7})
+        return HttpResponse()
+
+    def test_records_carry_the_request_id(self):
+        middleware = RequestIdMiddleware(self.view)
+        response = middleware(RequestFactory().get("/x", HTTP_X_REQUEST_ID="abc-123"))
+        self.assertEqual(response["X-Request-ID"], "abc-123")
+        generated = middleware(RequestFactory().get("/y", HTTP_X_REQUEST_ID="not valid!"))["X-Request-ID"]
+        self.assertRegex(generated, r"^[0-9a-f]{32}$")
+        self.logger.info("outside a request")
+
+        first, second, outside = self.records()
+        self.assertEqual((first["msg"], first["request_id"], first["user_id"]), ("handled /x", "abc-123", 7))
+        self.assertEqual(second["request_id"], generated)
+        self.assertNotIn("request_id", outside)
+        self.assertIsNone(request_id.get())
+
+    async def test_async_requests_are_tagged(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = RequestIdMiddleware(view)
+        response = await middleware(AsyncRequestFactory().get("/z", headers={"X-Request-ID": "async-1"}))
+        self.assertEqual(response["X-Request-ID"], "async-1")
+        self.assertEqual(self.records()[0]["request_id"], "async-1")
+
+    def test_full_queue_drops_records(self):
+        handler = BackgroundHandler(console=False, max_queue_size=1)
+        self.addCleanup(handler.close)
+        handler.stop()
+        for number in range(3):
+            handler.handle(logging.makeLogRecord({"msg": f"record {number}", "levelno": logging.INFO}))
+        self.assertEqual(handler.stats(), {"queued": 1, "dropped": 2})
+
+
+class MetricsViewTests(TestCase):
+    url = reverse("metrics")
+
+    @override_settings(METRICS={**settings.METRICS, "TOKEN": ""}, DEBUG=False)
+    def test_hidden_without_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS={**settings.METRICS, "TOKEN": "scrape-secret"})
+    def test_token_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    @override_settings(METRICS={**settings.METRICS, "TOKEN": "", "DEBUG_HEADER": True}, DEBUG=True)
+    def test_requests_are_recorded_per_endpoint(self):
+        throttle = mock.patch.object(TokenBucketThrottle, "backend", LocalBucketBackend())
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(user).access_token}"}
+        user_cache.clear()
+        with mock.patch("core.metrics.registry", Registry()) as registry:
+            response = self.client.get(reverse("accounts:user_me"), HTTP_X_DEBUG_TIMINGS="1", **auth)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertRegex(response["Server-Timing"], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="1 queries"')
+            self.assertIn("jwt_verify;dur=", response["Server-Timing"])
+            # warm user cache, and no header asked for
+            response = self.client.get(reverse("accounts:user_me"), **auth)
+            self.assertNotIn("Server-Timing", response)
+            page = self.client.get(self.url).content.decode()
+
+        labels = (("endpoint", "accounts:user_me"),)
+        self.assertEqual(registry.requests[("accounts:user_me", "GET", 200)], 2)
+        queries = registry.histograms[("request_db_queries", labels)]
+        self.assertEqual((queries.count, queries.sum), (2, 1))
+        self.assertEqual(registry.histograms[("request_db_seconds", labels)].count, 2)
+        self.assertEqual(registry.histograms[("request_phase_seconds", labels + (("phase", "jwt_verify"),))].count, 2)
+        self.assertIn('auth_request_db_queries_count{endpoint="accounts:user_me"} 2', page)
+
+
+@skipIf(settings.ASYNC_VIEWS, "budgets are for the DRF views")
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    # still throttled, but never enough to fail a request
+    "DEFAULT_THROTTLE_RATES": {scope: "1000000/min" for scope in settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]},
+})
+class UserCacheTests(APITestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def profile(self):
+        return self.client.get(reverse("accounts:user_me"), **self.headers)
+
+    def test_ttl_and_lru_bound(self):
+        now = [0.0]
+        cache = TTLLRUCache(max_size=2, ttl=10)
+        with mock.patch("accounts.cache.time.monotonic", side_effect=lambda: now[0]):
+            cache.set(1, "a")
+            cache.set(2, "b")
+            self.assertEqual(cache.get(1), "a")
+            # 2 is now the least recently used
+            cache.set(3, "c")
+            self.assertIsNone(cache.get(2))
+            self.assertEqual((cache.get(1), cache.get(3)), ("a", "c"))
+            now[0] += 10
+            self.assertIsNone(cache.get(1))
+            self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()["hits"], 3)
+
+    def test_warm_request_runs_no_user_query(self):
+        self.assertEqual(self.profile().status_code, status.HTTP_200_OK)
+        self.assertIn(self.user.pk, user_cache._data)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.profile().status_code, status.HTTP_200_OK)
+        self.assertEqual([query["sql"] for query in captured.captured_queries if "accounts_user" in query["sql"]], [])
+
+    def test_save_and_delete_evict(self):
+        self.profile()
+        self.user.first_name = "Alice"
+        self.user.save(update_fields=["first_name"])
+        self.assertNotIn(self.user.pk, user_cache._data)
+        self.assertEqual(self.profile().data["user"]["first_name"], "Alice")
+
+        self.user.delete()
+        self.assertNotIn(self.user.pk, user_cache._data)
+        self.assertEqual(self.profile().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.profile()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.profile().status_code, status.HTTP_401_UNAUTHORIZED)
+        # inactive users are not cached
+        self.assertNotIn(self.user.pk, user_cache._data)
+
+
+class EndpointBudgetTests(APITestCase):
+    """
+    Pins the queries (and the allocation peak) of every accounts route. Each
+    test's ``prepare`` sets up one request outside the measurement and
+    returns a callable sending it; it runs once against cold caches, then
+    against the caches the first request filled.
+    """
+
+    def setUp(self):
+        # write-behind batches are flushed here at the end of the test, not by
+        # flusher threads racing the measurement; one started by an earlier
+        # test keeps waiting on the event it already has
+        for buffer in (last_login_buffer, outstanding_tokens):
+            for patcher in (mock.patch.object(buffer, "_ensure_flusher"),
+                            mock.patch.object(buffer, "_wake", threading.Event())):
+                patcher.start()
+                self.addCleanup(patcher.stop)
+            self.addCleanup(buffer.flush)
+        self.counter = itertools.count()
+        self.password = PASSWORD
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password=PASSWORD)
+        self.access = str(RefreshToken.for_user(self.user).access_token)
+
+    def auth(self, user=None):
+        access = self.access if user is None else str(RefreshToken.for_user(user).access_token)
+        return {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def assertQueries(self, label, budget, captured):
+        queries = [query["sql"] for query in captured.captured_queries]
+        shapes = [query_shape(sql) for sql in queries]
+        if shapes == budget:
+            return
+        lines = [f"{label}: {len(shapes)} queries, budget {len(budget)}"]
+        lines.extend(difflib.unified_diff(budget, shapes, "budget", "actual", lineterm=""))
+        matcher = difflib.SequenceMatcher(a=budget, b=shapes, autojunk=False)
+        offending = [
+            queries[index]
+            for tag, _, _, start, end in matcher.get_opcodes() if tag in ("insert", "replace")
+            for index in range(start, end)
+        ]
+        if offending:
+            lines.append("unbudgeted SQL:")
+            lines.extend(f"  {sql}" for sql in offending)
+        self.fail("\n".join(lines))
+
+    def assertAllocationPeak(self, key, prepare, budget_kib):
+        # tracemalloc sees every thread, so the notification and log threads
+        # can inflate a single sample
+        peaks = []
+        for _ in range(3):
+            send = prepare()
+            tracemalloc.start()
+            try:
+                send()
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            finally:
+                tracemalloc.stop()
+            if peaks[-1] <= budget_kib:
+                return
+        self.fail(f"{key}: allocation peaks {', '.join(f'{peak:.0f}' for peak in peaks)} KiB, budget {budget_kib} KiB")
+
+    def assertBudget(self, key, prepare, status_code=status.HTTP_200_OK):
+        budget = BUDGETS[key]
+        for state in ("cold", "warm"):
+            send = prepare()
+            if state == "cold":
+                user_cache.clear()
+                revocation_index.reset()
+            with CaptureQueriesContext(connection) as captured:
+                response = send()
+            self.assertEqual(response.status_code, status_code, f"{key} ({state}): {getattr(response, 'data', '')}")
+            self.assertQueries(f"{key} ({state})", budget[state], captured)
+        if CHECK_ALLOCATIONS and budget["peak_kib"] is not None:
+            self.assertAllocationPeak(key, prepare, budget["peak_kib"])
+
+    def test_every_route_has_a_budget(self):
+        resolver = get_resolver().namespace_dict["accounts"][1]
+        routes = {name for name in resolver.reverse_dict if isinstance(name, str)}
+        self.assertEqual(routes, {key.split()[0] for key in BUDGETS})
+
+    def test_signup(self):
+        def prepare():
+            username = f"new{next(self.counter)}"
+            data = {"username": username, "email": f"{username}@example.com", "password": PASSWORD}
+            return lambda: self.client.post(reverse("accounts:signup_user"), data)
+
+        self.assertBudget("signup_user", prepare, status.HTTP_201_CREATED)
+
+    def test_login(self):
+        def prepare():
+            data = {"email": "alice@example.com", "password": PASSWORD}
+            return lambda: self.client.post(reverse("accounts:login"), data)
+
+        self.assertBudget("login", prepare)
+
+    def test_token_refresh(self):
+        tokens = {"refresh": str(RefreshToken.for_user(self.user))}
+
+        def send():
+            response = self.client.post(reverse("accounts:token_refresh"), tokens)
+            # rotation retires the token that was sent
+            tokens["refresh"] = response.data.get("refresh", tokens["refresh"])
+            return response
+
+        self.assertBudget("token_refresh", lambda: send)
+
+    def test_token_verify(self):
+        def prepare():
+            return lambda: self.client.post(reverse("accounts:token_verify"), {"token": self.access})
+
+        self.assertBudget("token_verify", prepare)
+
+    @override_settings(INTROSPECTION={**settings.INTROSPECTION, "TOKEN": "gateway-secret"})
+    def test_token_introspect(self):
+        def prepare():
+            tokens = [self.access, str(RefreshToken.for_user(self.user))]
+            return lambda: self.client.post(reverse("accounts:token_introspect"), {"tokens": tokens}, format="json",
+                                            HTTP_X_GATEWAY_TOKEN="gateway-secret")
+
+        self.assertBudget("token_introspect", prepare)
+
+    def test_logout(self):
+        def prepare():
+            refresh = str(RefreshToken.for_user(self.user))
+            return lambda: self.client.post(reverse("accounts:logout"), {"refresh": refresh}, **self.auth())
+
+        self.assertBudget("logout", prepare, status.HTTP_205_RESET_CONTENT)
+
+    def test_token_blacklist(self):
+        def prepare():
+            refresh = str(RefreshToken.for_user(self.user))
+            return lambda: self.client.post(reverse("accounts:token_blacklist"), {"refresh": refresh})
+
+        self.assertBudget("token_blacklist", prepare)
+
+    def test_password_change(self):
+        def send():
+            new_password = f"{PASSWORD}-{next(self.counter)}"
+            data = {"password": self.password, "new_password": new_password}
+            response = self.client.post(reverse("accounts:password_change"), data, **self.auth())
+            self.password = new_password
+            return response
+
+        self.assertBudget("password_change", lambda: send)
+
+    def test_password_reset(self):
+        def prepare():
+            return lambda: self.client.post(reverse("accounts:password_reset"), {"email": "alice@example.com"})
+
+        self.assertBudget("password_reset", prepare)
+
+    def test_password_reset_confirm(self):
+        def prepare():
+            user = User.objects.get(pk=self.user.pk)
+            data = {
+                "uid": encode_uid(user),
+                "token": reset_tokens.make_token(user),
+                "new_password": f"{PASSWORD}-{next(self.counter)}",
+            }
+            return lambda: self.client.post(reverse("accounts:password_reset_confirm"), data)
+
+        self.assertBudget("password_reset_confirm", prepare)
+
+    def assertChangeBudget(self, field, data_field, value):
+        def prepare():
+            return lambda: self.client.post(reverse(f"accounts:{field}_change"), {data_field: value()}, **self.auth())
+
+        def prepare_confirm():
+            data = {data_field: value()}
+            data["code"] = verification_codes.issue(self.user.pk, field, data[data_field])
+            return lambda: self.client.post(reverse(f"accounts:{field}_change_confirm"), data, **self.auth())
+
+        self.assertBudget(f"{field}_change", prepare)
+        self.assertBudget(f"{field}_change_confirm", prepare_confirm)
+
+    def test_email_change(self):
+        self.assertChangeBudget("email", "new_email", lambda: f"alice{next(self.counter)}@example.com")
+
+    def test_phone_change(self):
+        self.assertChangeBudget("phone", "phone", lambda: f"+99655512345{next(self.counter)}")
+
+    def test_username_change(self):
+        self.assertChangeBudget("username", "username", lambda: f"alice{next(self.counter)}")
+
+    def test_profile(self):
+        def prepare_get():
+            return lambda: self.client.get(reverse("accounts:user_me"), **self.auth())
+
+        def prepare_patch():
+            data = {"first_name": f"Alice{next(self.counter)}"}
+            return lambda: self.client.patch(reverse("accounts:user_me"), data, **self.auth())
+
+        def prepare_delete():
+            user = User.objects.create_user(username=f"gone{next(self.counter)}", password=PASSWORD)
+            headers = self.auth(user)
+            # a warm worker has just served this user
+            self.client.get(reverse("accounts:user_me"), **headers)
+            return lambda: self.client.delete(reverse("accounts:user_me"), **headers)
+
+        self.assertBudget("user_me GET", prepare_get)
+        self.assertBudget("user_me PATCH", prepare_patch)
+        self.assertBudget("user_me DELETE", prepare_delete, status.HTTP_204_NO_CONTENT)
+
+    def test_admin_lists(self):
+        admin = User.objects.create_superuser("admin", PASSWORD)
+        headers = self.auth(admin)
+
+        def prepare_list():
+            return lambda: self.client.get(reverse("accounts:user_list"), **headers)
+
+        def prepare_export():
+            def send():
+                response = self.client.get(reverse("accounts:users_export"), **headers)
+                # the rows are read while the body streams
+                b"".join(response.streaming_content)
+                return response
+            return send
+
+        self.assertBudget("user_list", prepare_list)
+        self.assertBudget("users_export", prepare_export)
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# the clock is the Redis server's, so skew between app hosts cannot change
+# refill rates (TIME before a write needs Redis 5+ effects replication)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class LocalBucketBackend:
+    """
+    Token buckets in process memory: two floats per key and no I/O. Limits
+    are per worker process, so use the Redis backend when running several.
+    """
+
+    def __init__(self, max_keys: int = 100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self._lock:
+            now = self.clock()
+            tokens, ts = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "max_keys": self.max_keys}
+
+    async def atake(self, key, capacity, rate):
+        return self.take(key, capacity, rate)
+
+
+class RedisBucketBackend:
+    """
+    Token buckets in Redis (or any server speaking its protocol), updated by
+    one Lua script call per request so limits hold across workers and hosts.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured("THROTTLE BACKEND 'redis' requires the redis package")
+        self._script = redis.Redis.from_url(url).register_script(TOKEN_BUCKET_SCRIPT)
+        self._ascript = redis.asyncio.Redis.from_url(url).register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, tokens = self._script(keys=[f"throttle:{key}"], args=[capacity, rate])
+        return bool(allowed), float(tokens)
+
+    async def atake(self, key, capacity, rate):
+        allowed, tokens = await self._ascript(keys=[f"throttle:{key}"], args=[capacity, rate])
+        return bool(allowed), float(tokens)
+
+
+def parse_rate(rate):
+    """
+    Parses DRF rate strings such as ``"10/min"`` into ``(requests, seconds)``.
+    """
+    num, period = rate.split("/")
+    return int(num), {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+
+
+def get_backend():
+    if settings.THROTTLE["BACKEND"] == "redis":
+        return RedisBucketBackend(settings.THROTTLE["REDIS_URL"])
+    return LocalBucketBackend(settings.THROTTLE["MAX_KEYS"])
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Drop-in replacement for ScopedRateThrottle: a view opts in with
+    ``throttle_scope`` and the rate comes from ``DEFAULT_THROTTLE_RATES``.
+    Each key keeps only a token count and a timestamp, refilled at
+    ``num_requests / duration`` per second up to ``num_requests``.
+    """
+
+    backend = None
+    scope_attr = "throttle_scope"
+    # {scope: {"allowed": n, "throttled": n}} in this process
+    decisions = {}
+    _decisions_lock = threading.Lock()
+
+    def __init__(self):
+        if TokenBucketThrottle.backend is None:
+            TokenBucketThrottle.backend = get_backend()
+        self.tokens = None
+        self.rate = None
+        self.scope = None
+
+    def get_cache_key(self, request, view, scope):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return f"{scope}:{ident}"
+
+    def get_bucket(self, request, view):
+        """
+        Returns ``(key, capacity)`` for the view's scope, or None when the
+        scope has no rate.
+        """
+        scope = getattr(view, self.scope_attr, None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return None
+        capacity, duration = parse_rate(rate)
+        self.rate = capacity / duration
+        self.scope = scope
+        return self.get_cache_key(request, view, scope), capacity
+
+    def count(self, allowed):
+        with self._decisions_lock:
+            counts = self.decisions.setdefault(self.scope, {"allowed": 0, "throttled": 0})
+            counts["allowed" if allowed else "throttled"] += 1
+
+    def allow_request(self, request, view):
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        allowed, self.tokens = self.backend.take(*bucket, self.rate)
+        self.count(allowed)
+        return allowed
+
+    async def aallow_request(self, request, view):
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        allowed, self.tokens = await self.backend.atake(*bucket, self.rate)
+        self.count(allowed)
+        return allowed
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._decisions_lock:
+            stats = {scope: dict(counts) for scope, counts in cls.decisions.items()}
+        if cls.backend is not None and hasattr(cls.backend, "stats"):
+            stats.update(cls.backend.stats())
+        return stats
+
+    def wait(self):
+        if self.tokens is None or not self.rate:
+            return None
+        return max(0.0, (1 - self.tokens) / self.rate)
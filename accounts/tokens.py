@@ -0,0 +1,204 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .issuance import outstanding_tokens
+from .models import TokenFamily
+from .revocation import revocation_index
+
+FAMILY_CLAIM = "fam"
+GENERATION_CLAIM = "gen"
+
+
+def family_is_current(family_id, generation) -> bool:
+    return TokenFamily.objects.filter(pk=family_id, generation=generation, revoked_at__isnull=True).exists()
+
+
+async def afamily_is_current(family_id, generation) -> bool:
+    return await TokenFamily.objects.filter(pk=family_id, generation=generation, revoked_at__isnull=True).aexists()
+
+
+def current_families(pairs) -> set:
+    """
+    Set-wise ``family_is_current`` for ``(family_id, generation)`` pairs, in
+    one ``IN`` query.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return set()
+    rows = TokenFamily.objects.filter(
+        pk__in={family_id for family_id, _ in pairs}, revoked_at__isnull=True,
+    ).values_list("pk", "generation")
+    return pairs & set(rows)
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    RefreshToken backed by a TokenFamily row when TOKEN_ISSUANCE["FAMILIES"]
+    is on: rotation and logout are single UPDATEs on that row and nothing is
+    written to the simplejwt blacklist tables.
+
+    Tokens issued before families were enabled (no ``fam`` claim) keep the
+    simplejwt behaviour: the blacklist is checked through the in-process
+    revocation index and new rows go through the batched OutstandingToken
+    buffer.
+    """
+
+    no_copy_claims = BaseRefreshToken.no_copy_claims + (GENERATION_CLAIM,)
+
+    @classmethod
+    def for_user(cls, user):
+        # skip BlacklistMixin.for_user, which inserts one row per token
+        token = super(BlacklistMixin, cls).for_user(user)
+        if settings.TOKEN_ISSUANCE["FAMILIES"]:
+            token.start_family(user.pk)
+        else:
+            token.track_outstanding(user.pk)
+        return token
+
+    @classmethod
+    async def afor_user(cls, user):
+        token = super(BlacklistMixin, cls).for_user(user)
+        if settings.TOKEN_ISSUANCE["FAMILIES"]:
+            await token.astart_family(user.pk)
+        else:
+            token.track_outstanding(user.pk)
+        return token
+
+    @classmethod
+    async def aload(cls, token: str):
+        """
+        Async twin of ``RefreshToken(token)``: the signature and claims are
+        checked in memory and the blacklist check is awaited.
+        """
+        token = _UncheckedRefreshToken(token)
+        await token.acheck_blacklist()
+        return token
+
+    def track_outstanding(self, user_id):
+        jti = self[api_settings.JTI_CLAIM]
+        outstanding_tokens.add(
+            jti,
+            OutstandingToken(
+                user_id=user_id,
+                jti=jti,
+                token=str(self),
+                created_at=self.current_time,
+                expires_at=datetime_from_epoch(self["exp"]),
+            ),
+        )
+
+    @property
+    def is_family(self) -> bool:
+        return FAMILY_CLAIM in self.payload
+
+    def start_family(self, user_id):
+        family = TokenFamily.objects.create(user_id=user_id, expires_at=datetime_from_epoch(self["exp"]))
+        self[FAMILY_CLAIM] = family.pk
+        self[GENERATION_CLAIM] = family.generation
+
+    async def astart_family(self, user_id):
+        family = await TokenFamily.objects.acreate(user_id=user_id, expires_at=datetime_from_epoch(self["exp"]))
+        self[FAMILY_CLAIM] = family.pk
+        self[GENERATION_CLAIM] = family.generation
+
+    def _family(self):
+        return TokenFamily.objects.filter(pk=self[FAMILY_CLAIM], revoked_at__isnull=True)
+
+    def revoke_family(self):
+        self._family().update(revoked_at=timezone.now())
+
+    async def arevoke_family(self):
+        await self._family().aupdate(revoked_at=timezone.now())
+
+    def check_family(self):
+        if not family_is_current(self[FAMILY_CLAIM], self[GENERATION_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    async def acheck_family(self):
+        if not await afamily_is_current(self[FAMILY_CLAIM], self[GENERATION_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def rotate(self):
+        """
+        Moves this token to the next generation of its family with one
+        conditional UPDATE. If the UPDATE matches nothing the token is an old
+        generation (or the family is gone), so the whole family is revoked.
+        """
+        generation = self[GENERATION_CLAIM]
+        self.set_jti()
+        self.set_exp()
+        self.set_iat()
+        updated = self._family().filter(generation=generation).update(
+            generation=generation + 1, expires_at=datetime_from_epoch(self["exp"]),
+        )
+        if not updated:
+            self.revoke_family()
+            raise TokenError(_("Token is blacklisted"))
+        self[GENERATION_CLAIM] = generation + 1
+
+    async def arotate(self):
+        generation = self[GENERATION_CLAIM]
+        self.set_jti()
+        self.set_exp()
+        self.set_iat()
+        updated = await self._family().filter(generation=generation).aupdate(
+            generation=generation + 1, expires_at=datetime_from_epoch(self["exp"]),
+        )
+        if not updated:
+            await self.arevoke_family()
+            raise TokenError(_("Token is blacklisted"))
+        self[GENERATION_CLAIM] = generation + 1
+
+    def check_blacklist(self):
+        if self.is_family:
+            # family state is enforced by rotate(), blacklist() and
+            # check_family(), each of which is a single query
+            return
+        if revocation_index.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    async def acheck_blacklist(self):
+        if self.is_family:
+            return
+        if await revocation_index.ais_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        if self.is_family:
+            updated = self._family().filter(generation=self[GENERATION_CLAIM]).update(revoked_at=timezone.now())
+            if not updated:
+                self.revoke_family()
+                raise TokenError(_("Token is blacklisted"))
+            return None
+        if self.payload[api_settings.JTI_CLAIM] in outstanding_tokens:
+            outstanding_tokens.flush()
+        blacklisted, created = super().blacklist()
+        if not created:
+            # lost a race with another worker (or the index was stale): the
+            # database row is authoritative, so the token must not be reused
+            raise TokenError(_("Token is blacklisted"))
+        revocation_index.add(self.payload[api_settings.JTI_CLAIM])
+        return blacklisted, created
+
+    async def ablacklist(self):
+        if not self.is_family:
+            # legacy tokens go through simplejwt's blacklist models
+            return await sync_to_async(self.blacklist)()
+        updated = await self._family().filter(generation=self[GENERATION_CLAIM]).aupdate(revoked_at=timezone.now())
+        if not updated:
+            await self.arevoke_family()
+            raise TokenError(_("Token is blacklisted"))
+        return None
+
+
+class _UncheckedRefreshToken(RefreshToken):
+    # RefreshToken.aload() awaits acheck_blacklist() instead
+    def check_blacklist(self):
+        pass
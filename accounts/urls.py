@@ -1,25 +1,43 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework_simplejwt.views import (
     TokenVerifyView,
-    TokenRefreshView,
     TokenBlacklistView,
 )
 
-from accounts import views
+from accounts import async_views, views
 
 app_name = "accounts"
 
+if settings.ASYNC_VIEWS:
+    login_view = async_views.LoginView.as_view()
+    token_refresh_view = async_views.TokenRefreshView.as_view()
+    token_verify_view = async_views.TokenVerifyView.as_view()
+    profile_view = async_views.ProfileView.as_view()
+else:
+    login_view = views.LoginView.as_view()
+    token_refresh_view = views.TokenRefreshView.as_view()
+    token_verify_view = TokenVerifyView.as_view()
+    profile_view = views.UserViewSet.as_view({"get": "retrieve", "patch": "partial_update", "delete": "destroy"})
+
 urlpatterns = [
     path("signup/", views.UserViewSet.as_view({"post": "create"}), name="signup_user"),
-    path("login/", views.LoginView.as_view(), name="login"),
-    path("login/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
-    path("login/verify/", TokenVerifyView.as_view(), name="token_verify"),
+    path("login/", login_view, name="login"),
+    path("login/refresh/", token_refresh_view, name="token_refresh"),
+    path("login/verify/", token_verify_view, name="token_verify"),
+    path("login/introspect/", views.TokenIntrospectView.as_view(), name="token_introspect"),
     path("logout/", views.LogoutView.as_view(), name="logout"),
     path("logout/blacklist/", TokenBlacklistView.as_view(), name="token_blacklist"),
     path("password/change/", views.ChangePasswordAPIView.as_view(), name="password_change"),
-    path(
-        "profile/", views.UserViewSet.as_view({"get": "retrieve", "patch": "partial_update", "delete": "destroy"}),
-        kwargs={"pk": "me"},
-        name="user_me",
-    ),
+    path("password/reset/", views.ResetPasswordAPIView.as_view(), name="password_reset"),
+    path("password/reset/confirm/", views.ResetPasswordConfirmAPIView.as_view(), name="password_reset_confirm"),
+    path("email/change/", views.ChangeEmailAPIView.as_view(), name="email_change"),
+    path("email/change/confirm/", views.ChangeEmailConfirmAPIView.as_view(), name="email_change_confirm"),
+    path("phone/change/", views.ChangePhoneAPIView.as_view(), name="phone_change"),
+    path("phone/change/confirm/", views.ChangePhoneConfirmAPIView.as_view(), name="phone_change_confirm"),
+    path("username/change/", views.ChangeUsernameAPIView.as_view(), name="username_change"),
+    path("username/change/confirm/", views.ChangeUsernameConfirmAPIView.as_view(), name="username_change_confirm"),
+    path("profile/", profile_view, kwargs={"pk": "me"}, name="user_me"),
+    path("users/", views.UserViewSet.as_view({"get": "list"}), name="user_list"),
+    path("users/export/", views.UserExportView.as_view(), name="users_export"),
 ]
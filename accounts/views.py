@@ -1,10 +1,33 @@
 from rest_framework import generics, status, viewsets, permissions, exceptions
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.utils import timezone
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
+from rest_framework_simplejwt import views as jwt_views
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
+from core.http import accepted_encodings
+from core.metrics import timer
+
+from .activity import last_login_buffer
+from .codes import CodeLocked, send_code, verification_codes
+from .export import FORMATS, aexport_users, export_users
+from .introspection import introspect
+from .issuance import should_issue_tokens
+from .keys import key_ring
 from .models import User
+from .pagination import KeysetPagination
+from .permissions import HasGatewayToken
+from .reset import get_user_by_uid, request_reset, reset_tokens
+from .tokens import RefreshToken
 from .serializers import (
     UserCreateSerializer,
     UserResponseSerializer,
@@ -13,25 +36,59 @@ from .serializers import (
     LogoutSerializer,
     ChangePasswordSerializer,
     ResetPasswordSerializer,
+    ResetPasswordConfirmSerializer,
+    TokenIntrospectSerializer,
+    TokenIntrospectResultSerializer,
     ChangeEmailSerializer,
     ChangeEmailConfirmSerializer,
+    ChangePhoneSerializer,
+    ChangePhoneConfirmSerializer,
+    ChangeUsernameSerializer,
+    ChangeUsernameConfirmSerializer,
 )
 
 
+def serialize_user(user, request):
+    with timer("serialize"):
+        return UserResponseSerializer(instance=user, context={"request": request}).data
+
+
+def encode_tokens(refresh):
+    with timer("jwt_sign"):
+        return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
 def get_user_with_token(user, request):
     refresh = RefreshToken.for_user(user)
-    data = {
-        "user": UserResponseSerializer(instance=user, context={"request": request}).data,
-        "refresh": str(refresh),
-        "access": str(refresh.access_token),
-    }
-    return data
+    return {"user": serialize_user(user, request), **encode_tokens(refresh)}
+
+
+async def aget_user_with_token(user, request):
+    refresh = await RefreshToken.afor_user(user)
+    return {"user": serialize_user(user, request), **encode_tokens(refresh)}
+
+
+def get_user_response(user, request, action: str):
+    # only the actions listed in TOKEN_ISSUANCE["ACTIONS"] mint a token pair
+    if should_issue_tokens(action):
+        return get_user_with_token(user, request)
+    return {"user": serialize_user(user, request)}
+
+
+async def aget_user_response(user, request, action: str):
+    if should_issue_tokens(action):
+        return await aget_user_with_token(user, request)
+    return {"user": serialize_user(user, request)}
 
 
 class UserViewSet(viewsets.ModelViewSet):
-    throttle_scopes = ["user"]
     queryset = User.objects.all()
     serializer_class = UserResponseSerializer
+    pagination_class = KeysetPagination
+
+    @property
+    def throttle_scope(self):
+        return "signup" if self.action == "create" else None
 
     def get_serializer_class(self):
         if self.action == "create":
@@ -43,6 +100,8 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action == "create":
             return [permissions.AllowAny()]
+        elif self.action == "list":
+            return [permissions.IsAdminUser()]
         elif self.action in ["update", "partial_update", "destroy"]:
             return [permissions.IsAuthenticated()]
         return [permissions.IsAuthenticated()]
@@ -51,7 +110,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = UserCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        data = get_user_with_token(user, request)
+        data = get_user_response(user, request, "signup")
         return Response(data=data, status=status.HTTP_201_CREATED)
 
     def partial_update(self, request, *args, **kwargs):
@@ -59,7 +118,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = UserUpdateSerializer(user, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        data = get_user_with_token(user, request)
+        data = get_user_response(user, request, "profile_update")
         return Response(data=data, status=status.HTTP_200_OK)
 
     def get_object(self):
@@ -74,23 +133,23 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         user = self.get_object()
-        data = get_user_with_token(user, request)
+        data = get_user_response(user, request, "profile")
         return Response(data)
 
 
 class LoginView(generics.CreateAPIView):
     serializer_class = LoginSerializer
     authentication_classes = []
+    throttle_scope = "login"
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = authenticate(**serializer.validated_data)
         if not user:
-            return exceptions.AuthenticationFailed()
-        user.last_login = timezone.now()
-        user.save()
-        data = get_user_with_token(user, request)
+            raise exceptions.AuthenticationFailed()
+        last_login_buffer.record(user, timezone.now())
+        data = get_user_response(user, request, "login")
         return Response(data=data, status=status.HTTP_200_OK)
 
 
@@ -101,46 +160,214 @@ class LogoutView(generics.CreateAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        token = RefreshToken(serializer.validated_data["refresh"])
-        token.blacklist()
+        try:
+            token = RefreshToken(serializer.validated_data["refresh"])
+            token.blacklist()
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
         return Response(status=status.HTTP_205_RESET_CONTENT, data={"success": "Logout successful"})
 
 
 class ChangePasswordAPIView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ChangePasswordSerializer
+    throttle_scope = "password_change"
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user: User = request.user
         data = serializer.validated_data
-        if not user.check_password(data["old_password"]):
+        if not user.check_password(data["password"]):
             raise exceptions.ValidationError({"error": "Old password is not correct"})
         user.set_password(data["new_password"])
         user.save()
         return Response(status=status.HTTP_200_OK, data={"success": "Password changed successfully"})
 
 
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    throttle_scope = "refresh"
+
+
+class TokenIntrospectView(generics.GenericAPIView):
+    """
+    Verifies up to INTROSPECTION["MAX_TOKENS"] tokens in one request, with
+    one query per lookup kind for the whole batch. Only staff users and the
+    gateway, by its shared token, may ask.
+    """
+    serializer_class = TokenIntrospectSerializer
+    permission_classes = [permissions.IsAdminUser | HasGatewayToken]
+    throttle_scope = "introspect"
+
+    @extend_schema(responses={200: inline_serializer("TokenIntrospectResults", {
+        "results": TokenIntrospectResultSerializer(many=True),
+    })})
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(data={"results": introspect(serializer.validated_data["tokens"])})
+
+
 class ResetPasswordAPIView(generics.CreateAPIView):
-    permission_classes = [permissions.IsAuthenticated]
     serializer_class = ResetPasswordSerializer
+    authentication_classes = []
+    throttle_scope = "password_reset"
 
     def post(self, request, *args, **kwargs):
-        pass
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # same answer whether or not the email is registered
+        request_reset(serializer.validated_data["email"])
+        return Response(status=status.HTTP_200_OK, data={"success": "If the email is registered, a reset link was sent"})
 
 
-class ChangeEmailAPIView(generics.CreateAPIView):
-    permission_classes = [permissions.IsAuthenticated]
-    serializer_class = ChangeEmailSerializer
+class ResetPasswordConfirmAPIView(generics.CreateAPIView):
+    serializer_class = ResetPasswordConfirmSerializer
+    authentication_classes = []
+    throttle_scope = "password_reset"
 
     def post(self, request, *args, **kwargs):
-        pass
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user = get_user_by_uid(data["uid"])
+        if user is None or not reset_tokens.check_token(user, data["token"]):
+            raise exceptions.ValidationError({"token": "invalid or expired token"})
+        user.set_password(data["new_password"])
+        user.save(update_fields=["password"])
+        return Response(status=status.HTTP_200_OK, data={"success": "Password reset successfully"})
 
 
-class ChangeEmailConfirmAPIView(generics.CreateAPIView):
+class BaseChangeAPIView(generics.CreateAPIView):
+    """
+    Sends a confirmation code for changing ``field`` to the value posted in
+    ``data_field``. Nothing is written to the database until the code is
+    confirmed by the matching BaseChangeConfirmAPIView.
+    """
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = ChangeEmailConfirmSerializer
+    throttle_scope = "code_issue"
+    field = None
+    data_field = None
+
+    def get_value(self, serializer):
+        value = serializer.validated_data[self.data_field]
+        if self.field == "email":
+            return User.objects.normalize_email(value)
+        return value
+
+    def get_destination(self, user, value):
+        if self.field == "phone":
+            return "sms", str(value)
+        if self.field == "email":
+            return "email", value
+        return "email", user.email
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user: User = request.user
+        value = self.get_value(serializer)
+        # uniqueness is enforced by the constraint when the code is confirmed
+        code = verification_codes.issue(user.pk, self.field, str(value))
+        send_code(*self.get_destination(user, value), code)
+        return Response(status=status.HTTP_200_OK, data={"success": "Confirmation code sent"})
+
+
+class BaseChangeConfirmAPIView(BaseChangeAPIView):
+    # wrong guesses are limited by the code lockout instead
+    throttle_scope = None
 
     def post(self, request, *args, **kwargs):
-        pass
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user: User = request.user
+        value = self.get_value(serializer)
+        try:
+            confirmed = verification_codes.check(user.pk, self.field, str(value), serializer.validated_data["code"])
+        except CodeLocked:
+            raise exceptions.Throttled(wait=verification_codes.lockout)
+        if not confirmed:
+            raise exceptions.ValidationError({"code": "invalid or expired code"})
+        setattr(user, self.field, value)
+        try:
+            with transaction.atomic():
+                user.save(update_fields=[self.field])
+        except IntegrityError:
+            raise exceptions.ValidationError({self.data_field: f"{self.field} already taken"})
+        return Response(status=status.HTTP_200_OK, data={"user": serialize_user(user, request)})
+
+
+class ChangeEmailAPIView(BaseChangeAPIView):
+    serializer_class = ChangeEmailSerializer
+    field = "email"
+    data_field = "new_email"
+
+
+class ChangeEmailConfirmAPIView(BaseChangeConfirmAPIView):
+    serializer_class = ChangeEmailConfirmSerializer
+    field = "email"
+    data_field = "new_email"
+
+
+class ChangePhoneAPIView(BaseChangeAPIView):
+    serializer_class = ChangePhoneSerializer
+    field = "phone"
+    data_field = "phone"
+
+
+class ChangePhoneConfirmAPIView(BaseChangeConfirmAPIView):
+    serializer_class = ChangePhoneConfirmSerializer
+    field = "phone"
+    data_field = "phone"
+
+
+class ChangeUsernameAPIView(BaseChangeAPIView):
+    serializer_class = ChangeUsernameSerializer
+    field = "username"
+    data_field = "username"
+
+
+class ChangeUsernameConfirmAPIView(BaseChangeConfirmAPIView):
+    serializer_class = ChangeUsernameConfirmSerializer
+    field = "username"
+    data_field = "username"
+
+
+class UserExportView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        parameters=[OpenApiParameter("output", enum=list(FORMATS), default="ndjson")],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    def get(self, request, *args, **kwargs):
+        fmt = request.query_params.get("output", "ndjson")
+        if fmt not in FORMATS:
+            raise exceptions.ValidationError({"output": f"must be one of: {', '.join(FORMATS)}"})
+        gzip = "gzip" in accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        # under ASGI only an async iterator is streamed rather than buffered
+        export = aexport_users if isinstance(request._request, ASGIRequest) else export_users
+        response = StreamingHttpResponse(export(fmt, gzip=gzip), content_type=FORMATS[fmt][1])
+        response["Content-Disposition"] = f'attachment; filename="users.{fmt}"'
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+@require_GET
+def jwks(request):
+    """
+    Public signing keys, prebuilt at startup. Conditional requests get a 304
+    carrying the same caching headers.
+    """
+    if key_ring is None:
+        # HMAC secrets are never published
+        raise Http404()
+    if key_ring.etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(key_ring.jwks, content_type="application/json")
+    response["ETag"] = key_ring.etag
+    patch_cache_control(response, public=True, max_age=settings.JWT_SIGNING["JWKS_MAX_AGE"])
+    return response
@@ -12,5 +12,18 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("ASYNC_VIEWS", "True")
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from accounts.revocation import revocation_index  # noqa: E402
+
+# build the blacklist index in the background instead of on a request
+revocation_index.start()
+
+if settings.SCHEMA["WARM"]:
+    # render the OpenAPI schema now rather than on the first request for it
+    from core.schema import schema_cache  # noqa: E402
+
+    schema_cache.warm()
@@ -0,0 +1,28 @@
+from functools import partial
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    """
+    PostgreSQL backend whose connections come from a per-process
+    ConnectionPool, configured through the ``POOL`` key of the database
+    settings. Django closing a connection, e.g. at the end of a request with
+    CONN_MAX_AGE = 0, returns it to the pool instead.
+    """
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(
+            self.alias,
+            conn_params,
+            self.settings_dict.get("POOL", {}),
+            partial(super().get_new_connection, conn_params),
+        )
+        return self.pool.getconn()
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by every thread of a
+    process, so it serves WSGI worker threads and the threads the async ORM
+    runs on alike.
+
+    At most ``max_size`` connections are open; a checkout beyond that waits up
+    to ``timeout`` seconds and then raises PoolTimeout. Connections idle for
+    longer than ``check_after`` seconds are pinged before being handed out,
+    connections older than ``max_lifetime`` are closed when returned, and
+    idle connections above ``min_size`` are closed after ``max_idle``.
+    """
+
+    def __init__(self, connect, min_size: int, max_size: int, timeout: float,
+                 max_lifetime: float, max_idle: float, check_after: float):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        # (connection, returned_at), most recently returned last
+        self._idle = deque()
+        self._size = 0
+        self._created_at = {}
+        self._cond = threading.Condition()
+        self._metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+        }
+        if min_size:
+            threading.Thread(target=self._fill, name="db-pool-fill", daemon=True).start()
+
+    def _open(self):
+        # called with a slot already reserved in self._size
+        try:
+            connection = self.connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(connection)] = time.monotonic()
+            self._metrics["created"] += 1
+        return connection
+
+    def _close(self, connection):
+        with self._cond:
+            self._size -= 1
+            self._created_at.pop(id(connection), None)
+            self._metrics["closed"] += 1
+            self._cond.notify()
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self._open()
+            except psycopg2.Error:
+                return
+            with self._cond:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def _is_usable(self, connection, returned_at) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+        while True:
+            with self._cond:
+                self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if not self._idle and self._size >= self.max_size:
+                            self._metrics["timeouts"] += 1
+                            raise PoolTimeout(
+                                f"no database connection available within {self.timeout}s "
+                                f"(pool max_size={self.max_size})"
+                            )
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                else:
+                    connection = None
+                    self._size += 1
+            if connection is None:
+                connection = self._open()
+            elif not self._is_usable(connection, returned_at):
+                with self._cond:
+                    self._metrics["health_check_failures"] += 1
+                self._close(connection)
+                continue
+            self._record_checkout(started if waited else None)
+            return connection
+
+    def _record_checkout(self, wait_started):
+        with self._cond:
+            self._metrics["checkouts"] += 1
+            if wait_started is not None:
+                waited = time.monotonic() - wait_started
+                self._metrics["waits"] += 1
+                self._metrics["wait_seconds_total"] += waited
+                self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], waited)
+
+    def putconn(self, connection):
+        if connection.closed:
+            self._close(connection)
+            return
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            self._close(connection)
+            return
+        with self._cond:
+            created_at = self._created_at.get(id(connection), 0)
+        if self.max_lifetime and time.monotonic() - created_at >= self.max_lifetime:
+            self._close(connection)
+            return
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def _evict_idle(self):
+        # called with self._cond held; the oldest idle connections are first
+        if not self.max_idle:
+            return
+        now = time.monotonic()
+        while len(self._idle) and self._size > self.min_size and now - self._idle[0][1] >= self.max_idle:
+            connection, _ = self._idle.popleft()
+            self._size -= 1
+            self._created_at.pop(id(connection), None)
+            self._metrics["closed"] += 1
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._metrics,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# pools inherited over fork() are kept referenced so their sockets, which the
+# parent still uses, are never closed from the child
+_inherited = []
+
+
+def get_pool(alias, conn_params: dict, options: dict, connect) -> ConnectionPool:
+    """
+    The pool for ``alias`` and these connection parameters, created on first
+    use. Keying on the parameters keeps e.g. the test database (same alias,
+    another NAME) from being handed connections to the real one.
+    """
+    key = (alias, repr(sorted(conn_params.items())))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    connect,
+                    min_size=options.get("MIN_SIZE", 0),
+                    max_size=options.get("MAX_SIZE", 10),
+                    timeout=options.get("TIMEOUT", 10.0),
+                    max_lifetime=options.get("MAX_LIFETIME", 3600.0),
+                    max_idle=options.get("MAX_IDLE", 600.0),
+                    check_after=options.get("CHECK_AFTER", 30.0),
+                )
+                pool.name = f"{alias}:{conn_params.get('dbname')}"
+    return pool
+
+
+def pool_stats() -> dict:
+    return {pool.name: pool.stats() for pool in list(_pools.values())}
+
+
+def _reset_after_fork():
+    global _pools_lock
+    _inherited.extend(_pools.values())
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
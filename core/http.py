@@ -0,0 +1,15 @@
+def accepted_encodings(accept_encoding: str) -> set:
+    """The content codings an Accept-Encoding header accepts, i.e. with q > 0."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            params = params[2:]
+        try:
+            quality = float(params) if params else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
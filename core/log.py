@@ -0,0 +1,173 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+request_id = contextvars.ContextVar("request_id", default=None)
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+# LogRecord attributes; anything else on a record came in through ``extra``
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per line, with ``extra`` fields inlined."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        # django.request logs the response after the middleware has returned
+        record.request_id = request_id.get() or getattr(getattr(record, "request", None), "request_id", None)
+        return True
+
+
+class SampleDebugFilter(logging.Filter):
+    """Keeps ``rate`` of the DEBUG records and every record above DEBUG."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Puts records on a bounded in-process queue; a QueueListener thread formats
+    them as JSON and writes them to stderr and/or ``filename``. The logging
+    thread only tags the record with the request id and renders its message,
+    and when the queue is full the record is dropped and counted rather than
+    waited for.
+    """
+
+    def __init__(self, console=True, filename=None, max_queue_size=10000, debug_sample_rate=1.0):
+        super().__init__(queue.Queue(max_queue_size))
+        self.max_queue_size = max_queue_size
+        self.dropped = 0
+        self.targets = []
+        formatter = JSONFormatter()
+        if console:
+            self.targets.append(logging.StreamHandler())
+        if filename:
+            if os.path.dirname(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self.targets.append(logging.FileHandler(filename, delay=True))
+        for target in self.targets:
+            target.setFormatter(formatter)
+        self.addFilter(RequestIdFilter())
+        self.addFilter(SampleDebugFilter(debug_sample_rate))
+        self.listener = None
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            # the listener thread does not survive fork(), and the queue's lock
+            # may have been held by it at that moment
+            os.register_at_fork(after_in_child=self._restart)
+
+    def start(self):
+        self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        # writes out what is still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def close(self):
+        self.stop()
+        super().close()
+
+    def _restart(self):
+        self.queue = queue.Queue(self.max_queue_size)
+        self.listener = None
+        self.start()
+
+    def prepare(self, record):
+        # the queue never leaves the process, so the record keeps its
+        # exc_info; only the message is rendered now, while its args are
+        # still current, and the request is not handed to another thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.__dict__.pop("request", None)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped}
+
+
+def log_stats() -> dict:
+    """Queue depth and drops of the root logger's BackgroundHandler."""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, BackgroundHandler):
+            return handler.stats()
+    return {}
+
+
+@sync_and_async_middleware
+def RequestIdMiddleware(get_response):
+    """
+    Tags the request's log records with the caller's X-Request-ID (or a new
+    one) and echoes it in the response.
+    """
+
+    def start(request):
+        value = request.headers.get("X-Request-ID", "")
+        request.request_id = value if REQUEST_ID_PATTERN.fullmatch(value) else uuid.uuid4().hex
+        return request_id.set(request.request_id)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start(request)
+            try:
+                response = await get_response(request)
+                response["X-Request-ID"] = request.request_id
+                return response
+            finally:
+                request_id.reset(token)
+    else:
+        def middleware(request):
+            token = start(request)
+            try:
+                response = get_response(request)
+                response["X-Request-ID"] = request.request_id
+                return response
+            finally:
+                request_id.reset(token)
+    return middleware
@@ -0,0 +1,235 @@
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import sync_and_async_middleware
+from django.views.decorators.http import require_GET
+
+PREFIX = "auth"
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+PHASES = ("password_hash", "jwt_sign", "jwt_verify", "serialize")
+
+# the RequestMetrics of the request being served, if any
+current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds", "phases")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.phases = {}
+
+
+def record(phase: str, seconds: float):
+    """Adds ``seconds`` to ``phase`` of the current request; no-op outside one."""
+    metrics = current.get()
+    if metrics is not None:
+        metrics.phases[phase] = metrics.phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timer(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def query_timer(execute, sql, params, many, context):
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created fires for every new (or pooled) connection of a
+    # DatabaseWrapper that may already carry the wrapper
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    In-process request metrics, one set per worker process, plus collectors:
+    callables returning the ``stats()`` dict of a component, exported as
+    gauges.
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.histograms = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+    def register_collector(self, name: str, collect, label: str = "name"):
+        self.collectors[name] = (collect, label)
+
+    def _observe(self, name, labels, buckets, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms.setdefault((name, labels), Histogram(buckets))
+        histogram.observe(value)
+
+    def observe_request(self, endpoint, method, status, seconds, metrics: RequestMetrics):
+        labels = (("endpoint", endpoint),)
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe("request_duration_seconds", labels, DURATION_BUCKETS, seconds)
+            self._observe("request_db_queries", labels, QUERY_BUCKETS, metrics.queries)
+            self._observe("request_db_seconds", labels, DURATION_BUCKETS, metrics.db_seconds)
+            for phase, phase_seconds in metrics.phases.items():
+                self._observe("request_phase_seconds", labels + (("phase", phase),), DURATION_BUCKETS, phase_seconds)
+
+    def render(self) -> str:
+        """The Prometheus text exposition format."""
+        lines = [f"# TYPE {PREFIX}_requests_total counter"]
+        with self._lock:
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'{PREFIX}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                )
+            histograms = sorted(
+                (name, labels, list(h.counts), h.sum, h.count, h.buckets) for (name, labels), h in self.histograms.items()
+            )
+        typed = set()
+        for name, labels, counts, total, count, buckets in histograms:
+            metric = f"{PREFIX}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label_text}}} {total}")
+            lines.append(f"{metric}_count{{{label_text}}} {count}")
+        for name, (collect, label) in self.collectors.items():
+            try:
+                stats = collect()
+            except Exception:
+                logging.getLogger(__name__).exception("Metrics collector %s failed", name)
+                continue
+            lines.extend(self._gauges(f"{PREFIX}_{name}", stats, label))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _gauges(metric, stats: dict, label: str):
+        # {"hits": 1} -> metric_hits 1; {"a": {"hits": 1}} -> metric_hits{label="a"} 1
+        lines = []
+        for key, value in sorted(stats.items()):
+            if isinstance(value, dict):
+                for field, field_value in sorted(value.items()):
+                    if isinstance(field_value, (int, float)):
+                        lines.append(f'{metric}_{field}{{{label}="{key}"}} {float(field_value)}')
+            elif isinstance(value, (int, float)):
+                lines.append(f"{metric}_{key} {float(value)}")
+        return lines
+
+
+registry = Registry()
+
+
+def server_timing(seconds: float, metrics: RequestMetrics) -> str:
+    entries = [
+        f"total;dur={seconds * 1000:.2f}",
+        f'db;dur={metrics.db_seconds * 1000:.2f};desc="{metrics.queries} queries"',
+    ]
+    entries.extend(f"{phase};dur={value * 1000:.2f}" for phase, value in metrics.phases.items())
+    return ", ".join(entries)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """
+    Times each request and its database queries, password hashing, JWT and
+    serializer work, and adds them to the registry under the URL name. With
+    METRICS["DEBUG_HEADER"] on, a request sending ``X-Debug-Timings: 1`` gets
+    them back in a Server-Timing header.
+    """
+    if not settings.METRICS["ENABLED"]:
+        raise MiddlewareNotUsed()
+    debug_header = settings.METRICS["DEBUG_HEADER"]
+
+    def finish(request, response, started, metrics):
+        seconds = time.perf_counter() - started
+        match = request.resolver_match
+        registry.observe_request(
+            match.view_name if match else "unmatched", request.method, response.status_code, seconds, metrics,
+        )
+        if debug_header and request.headers.get("X-Debug-Timings") == "1":
+            response["Server-Timing"] = server_timing(seconds, metrics)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            metrics = RequestMetrics()
+            token = current.set(metrics)
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                current.reset(token)
+            finish(request, response, started, metrics)
+            return response
+    else:
+        def middleware(request):
+            metrics = RequestMetrics()
+            token = current.set(metrics)
+            started = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                current.reset(token)
+            finish(request, response, started, metrics)
+            return response
+    return middleware
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Open without METRICS["TOKEN"] only with DEBUG on; otherwise the page does
+    not exist until a token is set.
+    """
+    token = settings.METRICS["TOKEN"]
+    if not token:
+        if not settings.DEBUG:
+            raise Http404()
+    elif not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,99 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("django.request")
+
+
+class MiddlewareStack(BaseHandler):
+    """
+    A handler over an explicit middleware list instead of settings.MIDDLEWARE;
+    it resolves the URL and runs process_view/process_exception hooks of its
+    own middleware only. ``load_middleware`` follows BaseHandler's.
+    """
+
+    def __init__(self, middleware: list, is_async: bool):
+        self.middleware = middleware
+        self.load_middleware(is_async)
+
+    def load_middleware(self, is_async=False):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        get_response = self._get_response_async if is_async else self._get_response
+        handler = convert_exception_to_response(get_response)
+        handler_is_async = is_async
+        for middleware_path in reversed(self.middleware):
+            middleware = import_string(middleware_path)
+            middleware_can_sync = getattr(middleware, "sync_capable", True)
+            middleware_can_async = getattr(middleware, "async_capable", False)
+            if not middleware_can_sync and not middleware_can_async:
+                raise RuntimeError(
+                    f"Middleware {middleware_path} must have at least one of sync_capable/async_capable set to True."
+                )
+            elif not handler_is_async and middleware_can_sync:
+                middleware_is_async = False
+            else:
+                middleware_is_async = middleware_can_async
+            try:
+                adapted_handler = self.adapt_method_mode(
+                    middleware_is_async, handler, handler_is_async,
+                    debug=settings.DEBUG, name=f"middleware {middleware_path}",
+                )
+                mw_instance = middleware(adapted_handler)
+            except MiddlewareNotUsed as exc:
+                if settings.DEBUG:
+                    logger.debug("MiddlewareNotUsed(%r): %s", middleware_path, exc)
+                continue
+            handler = adapted_handler
+            if mw_instance is None:
+                raise ImproperlyConfigured(f"Middleware factory {middleware_path} returned None.")
+
+            if hasattr(mw_instance, "process_view"):
+                self._view_middleware.insert(0, self.adapt_method_mode(is_async, mw_instance.process_view))
+            if hasattr(mw_instance, "process_template_response"):
+                self._template_response_middleware.append(
+                    self.adapt_method_mode(is_async, mw_instance.process_template_response)
+                )
+            if hasattr(mw_instance, "process_exception"):
+                self._exception_middleware.append(self.adapt_method_mode(False, mw_instance.process_exception))
+
+            handler = convert_exception_to_response(mw_instance)
+            handler_is_async = middleware_is_async
+
+        self._middleware_chain = self.adapt_method_mode(is_async, handler, handler_is_async)
+
+
+class MiddlewareDispatcher:
+    """
+    The only entry of settings.MIDDLEWARE: hands each request to the
+    middleware stack of the longest matching path prefix in
+    MIDDLEWARE_ROUTES. Stacks are compiled once, so the stateless JWT API
+    skips sessions, CSRF, messages and ``request.user`` entirely.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # each stack ends in its own URL resolution, so get_response is unused
+        is_async = iscoroutinefunction(get_response)
+        self.routes = [
+            (prefix, MiddlewareStack(middleware, is_async)._middleware_chain)
+            for prefix, middleware in sorted(settings.MIDDLEWARE_ROUTES.items(), key=lambda item: -len(item[0]))
+        ]
+        if is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        path = request.path_info
+        for prefix, chain in self.routes:
+            if path.startswith(prefix):
+                return chain(request)
+        raise ImproperlyConfigured(f"No MIDDLEWARE_ROUTES entry matches {path!r}")
@@ -0,0 +1,216 @@
+import gzip
+import hashlib
+import os
+import threading
+from importlib import import_module
+from importlib.metadata import version as package_version
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import translation
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView, SpectacularJSONAPIView
+
+from core.http import accepted_encodings
+
+
+def schema_language():
+    """
+    The active language as one of settings.LANGUAGES, falling back to
+    LANGUAGE_CODE, so unknown ``?lang=`` values share the default's schema
+    instead of each getting their own; None without i18n.
+    """
+    if not settings.USE_I18N:
+        return None
+    try:
+        return translation.get_supported_language_variant(translation.get_language())
+    except LookupError:
+        return translation.get_supported_language_variant(settings.LANGUAGE_CODE)
+
+
+def code_version() -> str:
+    """
+    SCHEMA["CODE_VERSION"] if set (e.g. the release's commit hash), otherwise
+    a hash of everything the schema is generated from: the project's own
+    sources, the schema settings and the DRF and drf-spectacular versions.
+    """
+    if settings.SCHEMA["CODE_VERSION"]:
+        return settings.SCHEMA["CODE_VERSION"]
+    base_dir = Path(settings.BASE_DIR)
+    roots = {Path(import_module(settings.ROOT_URLCONF).__file__).parent}
+    roots.update(Path(config.path) for config in apps.get_app_configs() if base_dir in Path(config.path).parents)
+    digest = hashlib.sha256()
+    for root in sorted(roots):
+        for path in sorted(root.rglob("*.py")):
+            digest.update(str(path.relative_to(base_dir)).encode())
+            digest.update(path.read_bytes())
+    digest.update(repr(sorted(settings.SPECTACULAR_SETTINGS.items())).encode())
+    digest.update(f"{package_version('djangorestframework')}:{package_version('drf-spectacular')}".encode())
+    return digest.hexdigest()[:16]
+
+
+class SchemaDocument:
+    """
+    One rendered schema, kept as bytes together with its compressed variants
+    and their ETags.
+    """
+
+    def __init__(self, body: bytes):
+        tag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {"identity": (body, f'"{tag}"'), "gzip": (gzip.compress(body, 9, mtime=0), f'"{tag}-gzip"')}
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            self.variants["br"] = (brotli.compress(body), f'"{tag}-br"')
+
+    def variant(self, accept_encoding: str):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding, *self.variants[encoding]
+        return "identity", *self.variants["identity"]
+
+
+class SchemaCache:
+    """
+    Rendered schemas by (api version, language, format). A miss reads the
+    files written by ``manage.py build_schema`` for the current code version,
+    and only if there are none generates the schema, which introspects every
+    view and serializer, and saves it there for the other workers.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory) if directory else None
+        self.documents = {}
+        self._lock = threading.Lock()
+        self._version = None
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = code_version()
+        return self._version
+
+    def _path(self, api_version, lang, fmt) -> Path:
+        return self.directory / self.version / f"{api_version or 'default'}.{lang or 'default'}.{fmt}"
+
+    def get(self, api_version, renderer) -> SchemaDocument:
+        lang = schema_language()
+        key = (api_version, lang, renderer.format)
+        document = self.documents.get(key)
+        if document is None:
+            with self._lock:
+                document = self.documents.get(key)
+                if document is None:
+                    document = self.documents[key] = SchemaDocument(self._load(api_version, lang, renderer))
+        return document
+
+    def _load(self, api_version, lang, renderer) -> bytes:
+        if self.directory:
+            try:
+                return self._path(api_version, lang, renderer.format).read_bytes()
+            except OSError:
+                pass
+        with translation.override(lang):
+            body = self.render(api_version, renderer)
+        if self.directory:
+            try:
+                self.save(self._path(api_version, lang, renderer.format), body)
+            except OSError:
+                pass
+        return body
+
+    @staticmethod
+    def render(api_version, renderer) -> bytes:
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(api_version=api_version)
+        schema = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+        return renderer.render(schema, renderer.media_type, renderer_context={})
+
+    @staticmethod
+    def save(path: Path, body: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(body)
+        os.replace(temporary, path)
+
+    def build(self) -> list:
+        """
+        Renders the schema of every CachedSchemaView in the URLconf and, with
+        a directory configured, writes it out; returns the keys built.
+        """
+        built = []
+        for api_version, renderer_classes in schema_views():
+            for renderer_class in renderer_classes:
+                renderer = renderer_class()
+                lang = schema_language()
+                key = (api_version, lang, renderer.format)
+                if key in built:
+                    continue
+                with translation.override(lang):
+                    body = self.render(api_version, renderer)
+                if self.directory:
+                    self.save(self._path(api_version, lang, renderer.format), body)
+                self.documents[key] = SchemaDocument(body)
+                built.append(key)
+        return built
+
+    def warm(self):
+        for api_version, renderer_classes in schema_views():
+            for renderer_class in renderer_classes:
+                self.get(api_version, renderer_class())
+
+
+def schema_views(patterns=None):
+    """(api_version, renderer classes) of each CachedSchemaView in the URLconf."""
+    found = []
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            found.extend(schema_views(pattern.url_patterns))
+        elif isinstance(pattern, URLPattern):
+            view_class = getattr(pattern.callback, "view_class", None)
+            if view_class and issubclass(view_class, CachedSchemaView):
+                initkwargs = pattern.callback.view_initkwargs
+                found.append((
+                    initkwargs.get("api_version", view_class.api_version),
+                    initkwargs.get("renderer_classes", view_class.renderer_classes),
+                ))
+    return found
+
+
+schema_cache = SchemaCache(settings.SCHEMA["DIR"])
+
+
+class CachedSchemaView(SpectacularAPIView):
+    """
+    SpectacularAPIView serving the pre-rendered schema from ``schema_cache``,
+    with ETag/If-None-Match revalidation and gzip or brotli bodies.
+    """
+
+    def _get_schema_response(self, request):
+        version = self.api_version or request.version or self._get_version_parameter(request)
+        document = schema_cache.get(version, request.accepted_renderer)
+        encoding, body, etag = document.variant(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and (if_none_match.strip() == "*" or etag in parse_etags(if_none_match)):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=request.accepted_media_type)
+            response["Content-Disposition"] = f'inline; filename="{self._get_filename(request, version)}"'
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        # revalidate on every use, a deploy may have changed the schema
+        patch_cache_control(response, public=True, no_cache=True)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+class CachedJSONSchemaView(CachedSchemaView):
+    renderer_classes = SpectacularJSONAPIView.renderer_classes
@@ -9,7 +9,7 @@ environ.Env.read_env(env_file=".env")
 
 SECRET_KEY = env("SECRET_KEY")
 
-DEBUG = True
+DEBUG = env.bool("DEBUG", default=True)
 
 ALLOWED_HOSTS = []
 
@@ -41,8 +41,11 @@ LOCAL_APPS = [
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
-MIDDLEWARE = [
+FULL_MIDDLEWARE = [
+    "core.log.RequestIdMiddleware",
+    "core.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "accounts.routers.ReplicaPinMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     'corsheaders.middleware.CorsMiddleware',  # CORS
     "django.middleware.common.CommonMiddleware",
@@ -52,6 +55,34 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The JWT API uses no sessions, cookies, CSRF or messages
+API_MIDDLEWARE = [
+    "core.log.RequestIdMiddleware",
+    "core.metrics.MetricsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "accounts.routers.ReplicaPinMiddleware",
+    'corsheaders.middleware.CorsMiddleware',  # CORS
+    "django.middleware.common.CommonMiddleware",
+]
+
+# Path prefix -> middleware stack; the longest matching prefix wins. Set
+# LEAN_MIDDLEWARE=False to run FULL_MIDDLEWARE everywhere.
+MIDDLEWARE_ROUTES = {
+    "/api/v1/auth/": API_MIDDLEWARE,
+    "/api/v1/schema": API_MIDDLEWARE,
+    "/.well-known/": API_MIDDLEWARE,
+    "/metrics": API_MIDDLEWARE,
+    "/": FULL_MIDDLEWARE,
+}
+
+if env.bool("LEAN_MIDDLEWARE", default=True):
+    MIDDLEWARE = ["core.middleware.MiddlewareDispatcher"]
+    # the admin checks only look at MIDDLEWARE; its stack under "/" has
+    # the session, auth and messages middleware they ask for
+    SILENCED_SYSTEM_CHECKS = ["admin.E408", "admin.E409", "admin.E410"]
+else:
+    MIDDLEWARE = FULL_MIDDLEWARE
+
 ROOT_URLCONF = "core.urls"
 
 TEMPLATES = [
@@ -76,17 +107,80 @@ WSGI_APPLICATION = "core.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# With DB_POOL on, core.db hands out connections from an in-process pool of
+# MIN_SIZE..MAX_SIZE connections; a request that finds none free waits up to
+# TIMEOUT seconds. Connections go back to the pool at the end of each request,
+# which also keeps ASGI (a thread per request) from leaking them. With it off,
+# each thread keeps its connection for DB_CONN_MAX_AGE seconds.
+DB_POOL = env.bool("DB_POOL", default=True)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'core.db' if DB_POOL else 'django.db.backends.postgresql_psycopg2',
         'NAME': env("POSTGRES_DB"),
         'USER': env("POSTGRES_USER"),
         'PASSWORD': env("POSTGRES_PASSWORD"),
         'HOST': env("POSTGRES_HOST"),
         'PORT': env("POSTGRES_PORT"),
+        'CONN_MAX_AGE': 0 if DB_POOL else env.int("DB_CONN_MAX_AGE", default=60),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            "MIN_SIZE": env.int("DB_POOL_MIN_SIZE", default=2),
+            "MAX_SIZE": env.int("DB_POOL_MAX_SIZE", default=20),
+            "TIMEOUT": env.float("DB_POOL_TIMEOUT", default=10.0),
+            "MAX_LIFETIME": env.float("DB_POOL_MAX_LIFETIME", default=3600.0),
+            "MAX_IDLE": env.float("DB_POOL_MAX_IDLE", default=600.0),
+            # idle connections older than this are pinged before reuse
+            "CHECK_AFTER": env.float("DB_POOL_CHECK_AFTER", default=30.0),
+        },
     }
 }
 
+# e.g. for local benchmarks (manage.py benchmark) without a PostgreSQL server
+if env("DB_SQLITE_PATH", default=""):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": env("DB_SQLITE_PATH"),
+        "OPTIONS": {"timeout": 30},
+    }
+
+# Reads go to the POSTGRES_REPLICA_HOSTS (host or host:port, same database and
+# credentials as the primary), writes to the primary. A user who just wrote
+# (signup, profile or password change) is read from the primary for
+# STICKY_SECONDS after the commit, which should exceed the usual replication
+# lag. The pin is kept in the default cache, which is per-process locmem
+# unless CACHE_URL says otherwise; with several workers point CACHE_URL at a
+# shared cache, or only the worker that took the write honours the pin.
+REPLICAS = {
+    "HOSTS": env.list("POSTGRES_REPLICA_HOSTS", default=[]),
+    "STICKY_SECONDS": env.float("REPLICA_STICKY_SECONDS", default=5.0),
+    # token state is always read from the primary
+    "PRIMARY_MODELS": [
+        "accounts.tokenfamily",
+        "token_blacklist.outstandingtoken",
+        "token_blacklist.blacklistedtoken",
+    ],
+    "ALIASES": [],
+}
+for index, replica in enumerate(REPLICAS["HOSTS"], start=1):
+    host, _, port = replica.partition(":")
+    alias = f"replica_{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICAS["ALIASES"].append(alias)
+
+DATABASE_ROUTERS = ["accounts.routers.ReplicaRouter"]
+
+
+# locmem is per process; point CACHE_URL at redis/memcached when running
+# several workers, otherwise confirmation codes are only seen by one of them.
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -106,21 +200,97 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.EmailBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# Password hashing runs in a pool of WORKERS processes (0 = inline on the
+# request thread). Once MAX_PENDING operations are in flight further logins,
+# signups and password changes get 503 with Retry-After instead of queueing.
+PASSWORD_HASHING = {
+    "WORKERS": env.int("PASSWORD_HASHING_WORKERS", default=2),
+    "MAX_PENDING": env.int("PASSWORD_HASHING_MAX_PENDING", default=16),
+    "TIMEOUT": env.float("PASSWORD_HASHING_TIMEOUT", default=5.0),
+}
+
+# last_login timestamps are coalesced in memory and written in one batched
+# UPDATE at most FLUSH_INTERVAL seconds after the login.
+LAST_LOGIN_BUFFER = {
+    "BATCH_SIZE": env.int("LAST_LOGIN_BATCH_SIZE", default=1000),
+    "FLUSH_INTERVAL": env.float("LAST_LOGIN_FLUSH_INTERVAL", default=5.0),
+}
+
+# With an asymmetric ALGORITHM (RS256, EdDSA, ...) tokens are signed with the
+# first of PRIVATE_KEY_FILES and carry its kid; the remaining files are retired
+# keys kept for verification. All public keys are served at
+# /.well-known/jwks.json so other services can verify tokens locally.
+JWT_SIGNING = {
+    "ALGORITHM": env("JWT_ALGORITHM", default="HS256"),
+    "PRIVATE_KEY_FILES": env.list("JWT_PRIVATE_KEY_FILES", default=[]),
+    "JWKS_MAX_AGE": env.int("JWKS_MAX_AGE", default=300),
+}
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(env("ACCESS_TOKEN_LIFETIME"))),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=int(env("REFRESH_TOKEN_LIFETIME"))),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'ALGORITHM': 'HS256',
-    'UPDATE_LAST_LOGIN': True,
+    'ALGORITHM': JWT_SIGNING["ALGORITHM"],
+    'UPDATE_LAST_LOGIN': False,  # LoginView records it through LAST_LOGIN_BUFFER
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
     'USER_ID_FIELD': 'id',
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.serializers.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'accounts.serializers.TokenVerifySerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'accounts.serializers.TokenBlacklistSerializer',
+}
+
+# Serve login, refresh, verify and profile with the native async views in
+# accounts.async_views. core/asgi.py turns this on; under WSGI the DRF views
+# are used.
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
+# Views that return a fresh token pair along with the user (see
+# accounts.views.get_user_response). With FAMILIES on, each login gets one
+# accounts.TokenFamily row and rotation/logout update it in place. With it off,
+# new OutstandingToken rows are written in batches of OUTSTANDING_BATCH_SIZE
+# or every OUTSTANDING_FLUSH_INTERVAL seconds.
+TOKEN_ISSUANCE = {
+    "ACTIONS": ("signup", "login"),
+    "FAMILIES": env.bool("REFRESH_TOKEN_FAMILIES", default=True),
+    "OUTSTANDING_BATCH_SIZE": env.int("OUTSTANDING_TOKEN_BATCH_SIZE", default=100),
+    "OUTSTANDING_FLUSH_INTERVAL": env.float("OUTSTANDING_TOKEN_FLUSH_INTERVAL", default=1.0),
+}
+
+# In-process Bloom filter over blacklisted jti values. A token blacklisted by
+# another worker is seen by this one within SYNC_INTERVAL seconds; refresh
+# rotation is always decided by the database. SYNC_MARGIN must exceed the
+# longest commit delay plus the clock skew between app hosts.
+REVOCATION_INDEX = {
+    "CAPACITY": env.int("REVOCATION_INDEX_CAPACITY", default=1_000_000),
+    "ERROR_RATE": env.float("REVOCATION_INDEX_ERROR_RATE", default=0.001),
+    "SYNC_INTERVAL": env.float("REVOCATION_INDEX_SYNC_INTERVAL", default=1.0),
+    "SYNC_MARGIN": env.float("REVOCATION_INDEX_SYNC_MARGIN", default=30.0),
+}
+
+# Batch token checks at auth/login/introspect/, open to staff users and to
+# callers sending TOKEN in the X-Gateway-Token header (disabled when empty).
+INTROSPECTION = {
+    "MAX_TOKENS": env.int("INTROSPECTION_MAX_TOKENS", default=500),
+    "TOKEN": env("INTROSPECTION_TOKEN", default=""),
+}
+
+# Per-process cache of authenticated users. Saves and deletes invalidate the
+# local worker at once; other workers pick the change up within TTL seconds.
+USER_CACHE = {
+    "MAX_SIZE": env.int("USER_CACHE_MAX_SIZE", default=10000),
+    "TTL": env.int("USER_CACHE_TTL", default=60),
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -130,12 +300,67 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.ScopedRateThrottle",
+        "accounts.throttling.TokenBucketThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {
+        "login": env("THROTTLE_RATE_LOGIN", default="10/min"),
+        "signup": env("THROTTLE_RATE_SIGNUP", default="5/min"),
+        "refresh": env("THROTTLE_RATE_REFRESH", default="30/min"),
+        "password_change": env("THROTTLE_RATE_PASSWORD_CHANGE", default="5/min"),
+        "password_reset": env("THROTTLE_RATE_PASSWORD_RESET", default="5/hour"),
+        "code_issue": env("THROTTLE_RATE_CODE_ISSUE", default="10/hour"),
+        "introspect": env("THROTTLE_RATE_INTROSPECT", default="600/min"),
     },
 }
 
+# Confirmation codes for email/phone/username changes live in the default
+# cache: TTL seconds to use a code, then after MAX_ATTEMPTS wrong guesses
+# within LOCKOUT seconds checks are refused until LOCKOUT has passed. The
+# counter is per user and purpose, so it survives asking for a new code. The
+# default cache is per-process locmem, so with several workers CACHE_URL must
+# point at a shared cache or each worker counts its own guesses.
+VERIFICATION_CODES = {
+    "TTL": env.int("VERIFICATION_CODE_TTL", default=600),
+    "MAX_ATTEMPTS": env.int("VERIFICATION_CODE_MAX_ATTEMPTS", default=5),
+    "LOCKOUT": env.int("VERIFICATION_CODE_LOCKOUT", default=900),
+}
+
+# Reset tokens are signed, not stored; they expire after PASSWORD_RESET_TIMEOUT
+# seconds or as soon as the password changes. PASSWORD_RESET_URL is formatted
+# with the uid and token and sent to the user.
+PASSWORD_RESET_TIMEOUT = env.int("PASSWORD_RESET_TIMEOUT", default=3600)
+PASSWORD_RESET_URL = env("PASSWORD_RESET_URL", default="/password/reset/confirm?uid={uid}&token={token}")
+
+# Outbound email/SMS. Requests only enqueue; WORKERS threads deliver in
+# batches of BATCH_SIZE, retrying after RETRY_BACKOFF ** attempt seconds and
+# dead-lettering after MAX_RETRIES. QUEUE "local" is drained inside each web
+# process; "redis" is shared and drained by `manage.py run_notifications`.
+NOTIFICATIONS = {
+    "QUEUE": env("NOTIFICATIONS_QUEUE", default="local"),
+    "REDIS_URL": env("NOTIFICATIONS_REDIS_URL", default="redis://localhost:6379/0"),
+    "WORKERS": env.int("NOTIFICATIONS_WORKERS", default=2),
+    "BATCH_SIZE": env.int("NOTIFICATIONS_BATCH_SIZE", default=50),
+    "MAX_RETRIES": env.int("NOTIFICATIONS_MAX_RETRIES", default=5),
+    "RETRY_BACKOFF": env.float("NOTIFICATIONS_RETRY_BACKOFF", default=2.0),
+    "BACKENDS": {
+        "email": {"BACKEND": env("NOTIFICATIONS_EMAIL_BACKEND", default="accounts.notifications.EmailBackend")},
+        # the console backend prints codes to stdout, so it is only the default
+        # with DEBUG on; otherwise sending SMS needs NOTIFICATIONS_SMS_BACKEND
+        "sms": {"BACKEND": env(
+            "NOTIFICATIONS_SMS_BACKEND",
+            default="accounts.notifications.ConsoleBackend" if DEBUG else "",
+        )},
+    },
+}
+
+# Token buckets for accounts.throttling.TokenBucketThrottle. "local" keeps
+# them in process memory (per worker); "redis" shares them through REDIS_URL.
+THROTTLE = {
+    "BACKEND": env("THROTTLE_BACKEND", default="local"),
+    "REDIS_URL": env("THROTTLE_REDIS_URL", default="redis://localhost:6379/0"),
+    "MAX_KEYS": env.int("THROTTLE_MAX_KEYS", default=100000),
+}
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'CORE API',
     'DESCRIPTION': 'Base django project with DRF and JWT',
@@ -150,11 +375,35 @@ SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
 }
 
-LOG_TO_FILE = env("LOG_TO_FILE")
-LOG_TO_CONSOLE = env("LOG_TO_CONSOLE")
+# The schema is rendered once per process (or once per release with
+# `manage.py build_schema`) and kept under DIR/<code version>/; CODE_VERSION
+# defaults to a hash of the project's sources.
+SCHEMA = {
+    "DIR": env("SCHEMA_DIR", default=str(BASE_DIR / "schema")),
+    "CODE_VERSION": env("CODE_VERSION", default=""),
+    "WARM": env.bool("SCHEMA_WARM", default=True),
+}
+
+# Per-endpoint request, query, hashing, JWT and serialization timings of this
+# process, served in the Prometheus format at /metrics behind "Authorization:
+# Bearer TOKEN". Without a TOKEN the page is open with DEBUG on and a 404
+# otherwise. With DEBUG_HEADER on, a request sending
+# "X-Debug-Timings: 1" gets its own timings in a Server-Timing header.
+METRICS = {
+    "ENABLED": env.bool("METRICS_ENABLED", default=True),
+    "TOKEN": env("METRICS_TOKEN", default=""),
+    "DEBUG_HEADER": env.bool("METRICS_DEBUG_HEADER", default=False),
+}
+
+LOG_TO_FILE = env.bool("LOG_TO_FILE")
+LOG_TO_CONSOLE = env.bool("LOG_TO_CONSOLE")
 LOG_LEVEL = env("LOG_LEVEL")
 LOG_DIR = env("LOG_DIR")
 
+# Records are queued by core.log.BackgroundHandler and written as JSON lines
+# by a background thread, so requests never wait on stderr or the log file.
+# With LOG_LEVEL=DEBUG, LOG_DEBUG_SAMPLE_RATE keeps that share of the DEBUG
+# records. mail_admins stays synchronous, it needs the live request.
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -169,19 +418,12 @@ LOGGING = {
         },
     },
     "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "console",
-        },
-        "django.server": {
-            "level": "INFO",
-            "class": "logging.StreamHandler",
-            "formatter": "console",
-        },
-        "django.request": {
-            "level": "DEBUG",
-            "class": "logging.StreamHandler",
-            "formatter": "console",
+        "background": {
+            "class": "core.log.BackgroundHandler",
+            "console": LOG_TO_CONSOLE,
+            "filename": LOG_DIR if LOG_TO_FILE else None,
+            "max_queue_size": env.int("LOG_QUEUE_SIZE", default=10000),
+            "debug_sample_rate": env.float("LOG_DEBUG_SAMPLE_RATE", default=1.0),
         },
         "mail_admins": {
             "level": "ERROR",
@@ -192,20 +434,12 @@ LOGGING = {
     },
     "loggers": {
         "": {
-            "level": "DEBUG",
-            "handlers": ["console", "mail_admins", "django.request"],
-        },
-        "django.server": {
-            "handlers": ["django.server"],
-            "propagate": False,
+            "level": LOG_LEVEL,
+            "handlers": ["background", "mail_admins"],
         },
     },
 }
 
-if LOG_TO_FILE:
-    LOGGING["handlers"]["file"] = {"level": "DEBUG", "class": "logging.FileHandler", "filename": env("LOG_DIR", default="logs/debug.log")}
-    LOGGING["loggers"][""]["handlers"].append("file")
-
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
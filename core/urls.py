@@ -15,22 +15,25 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from accounts.views import jwks
+from core.metrics import metrics_view
+from core.schema import CachedJSONSchemaView, CachedSchemaView
 from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularJSONAPIView,
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
 
 urlpatterns = [
+    path(".well-known/jwks.json", jwks, name="jwks"),
+    path("metrics", metrics_view, name="metrics"),
     path(
         "api/v1/",
         include(
             [
                 path("admin/", admin.site.urls),
 
-                path("schema/", SpectacularAPIView.as_view(api_version="v1"), name="schema"),
-                path("schema_json/", SpectacularJSONAPIView.as_view(api_version="v1"), name="schema_json"),
+                path("schema/", CachedSchemaView.as_view(api_version="v1"), name="schema"),
+                path("schema_json/", CachedJSONSchemaView.as_view(api_version="v1"), name="schema_json"),
                 path("swagger/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
                 path("redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
 